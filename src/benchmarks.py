@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import platform
+import random
+import string
+import tempfile
+import time
+from typing import Iterable, List
+
+from subdomain_bruteforce import Controller, Model, MemoryResolver, UDPResolver
+from dns_stub import StubDNSServer
+
+
+def legacy_get_words_from_file(file_name: str, start_from: str = None) -> Iterable[str]:
+    """The line by line reader replaced by the memory-mapped one, kept as a baseline"""
+
+    with open(file_name, "r") as f:
+        found = False
+
+        for line in f:
+            word = line.strip(" \n")
+
+            if word == start_from:
+                found = True
+
+            if start_from is None or found:
+                yield word
+
+
+def words_per_second(words: Iterable, batches: bool = False) -> float:
+    """Consumes the words, or the batches of words, and returns how many words were generated per second"""
+
+    start = time.perf_counter()
+    count = sum(map(len, words)) if batches else sum(1 for _ in words)
+    return count / (time.perf_counter() - start)
+
+
+def random_words(word_count: int) -> List[str]:
+    letters = string.ascii_lowercase + string.digits + "-"
+    return ["".join(random.choices(letters, k=random.randint(3, 12))) for _ in range(word_count)]
+
+
+def create_wordlist(word_count: int, compress: bool = False) -> str:
+    """Writes a temporary wordlist of random words, optionally compressed with gzip, and returns its name"""
+
+    content = "".join(word + "\n" for word in random_words(word_count)).encode()
+    with tempfile.NamedTemporaryFile("wb", suffix=".txt.gz" if compress else ".txt", delete=False) as f:
+        f.write(gzip.compress(content) if compress else content)
+        return f.name
+
+
+def stub_zone(word_count: int, found_ratio: float = 0.1) -> dict:
+    """Returns a zone of example.com where about found_ratio of the words w0, w1, ... have an address"""
+
+    zone = {"example.com": ["10.0.0.1"]}
+    for i in range(0, word_count, round(1 / found_ratio)):
+        zone[f"w{i}.example.com"] = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"]
+    return zone
+
+
+def benchmark_word_sources(word_count: int) -> dict:
+    """Returns the words per second of the generator and of the wordlist readers"""
+
+    results = {"generator": words_per_second(Controller.generate_word(5, stop=word_count))}
+
+    for compress in (False, True):
+        file_name = create_wordlist(word_count, compress)
+        suffix = " (gzip)" if compress else ""
+        try:
+            if not compress:
+                results["line reader"] = words_per_second(legacy_get_words_from_file(file_name))
+            results["mmap reader" if not compress else "stream reader (gzip)"] = \
+                words_per_second(Controller.get_words_from_file(file_name))
+            results["batches" + suffix] = words_per_second(Controller.get_word_batches_from_file(file_name),
+                                                           batches=True)
+        finally:
+            os.remove(file_name)
+    return results
+
+
+def benchmark_resolver(query_count: int, concurrency: int) -> dict:
+    """Returns the queries per second of the UDP resolver against a stub server, with at most concurrency queries
+    in flight, and the ratio of the queries which failed"""
+
+    async def resolve(server: StubDNSServer) -> dict:
+        resolver = UDPResolver([server.address], timeout=1.0)
+        await resolver.open()
+        semaphore, failures = asyncio.Semaphore(concurrency), 0
+
+        async def lookup(domain: str) -> None:
+            nonlocal failures
+            async with semaphore:
+                try:
+                    await resolver.resolve(domain)
+                except Exception:
+                    failures += 1
+
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(lookup(f"w{i}.example.com") for i in range(query_count)))
+            elapsed = time.perf_counter() - start
+        finally:
+            resolver.close()
+        return {"queries/second": query_count / elapsed, "failures": failures / query_count}
+
+    with StubDNSServer(stub_zone(query_count)) as server:
+        return asyncio.run(resolve(server))
+
+
+def benchmark_end_to_end(word_count: int, concurrency: int, engine: str, latency: float) -> dict:
+    """Returns the subdomains per second of a whole bruteforce, with the system engine against a memory resolver
+    or with the async engine against a stub server, both answering after latency seconds"""
+
+    words = [f"w{i}" for i in range(word_count)]
+    zone = stub_zone(word_count)
+
+    def run(resolver) -> dict:
+        start = time.perf_counter()
+        model = Model("example.com", None, words, thread_limit=concurrency, resolver=resolver, filter_wildcards=False)
+        model.bruteforce_thread.join()
+        elapsed = time.perf_counter() - start
+        return {"subdomains/second": word_count / elapsed, "found": len(model.found_subdomains)}
+
+    if engine == "system":
+        return run(MemoryResolver(zone, latency))
+    with StubDNSServer(zone, latency=latency) as server:
+        return run(UDPResolver([server.address], timeout=1.0 + latency))
+
+
+def run_benchmarks(word_count: int, query_count: int, levels: List[int], latency: float) -> dict:
+    results = {
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "word sources": benchmark_word_sources(word_count),
+        "resolver": {f"udp, concurrency {level}": benchmark_resolver(query_count, level) for level in levels},
+        "end to end": {},
+    }
+    for engine in ("system", "async"):
+        for level in levels:
+            results["end to end"][f"{engine}, concurrency {level}"] = \
+                benchmark_end_to_end(query_count, level, engine, latency)
+    return results
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Returns the numeric results by their path, e.g. "word sources / generator" """
+
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + " / "))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    """Prints the results, with their ratio to the ones of the baseline if any"""
+
+    previous = flatten(baseline) if baseline else {}
+    for name, value in flatten(results).items():
+        line = f"{name:>60}: {value:>14,.2f}"
+        if previous.get(name):
+            line += f"  ({value / previous[name]:.2f}x)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of subdomain_bruteforce, without network")
+    parser.add_argument("--words", "-w", help="Number of words of the word source benchmarks", type=int,
+                        default=2_000_000)
+    parser.add_argument("--queries", "-q", help="Number of queries of the resolver and end-to-end benchmarks",
+                        type=int, default=20_000)
+    parser.add_argument("--concurrency", "-c", help="Comma-separated numbers of queries in flight (default is "
+                        "10,100,1000)", type=lambda text: [int(level) for level in text.split(",")],
+                        default=[10, 100, 1000])
+    parser.add_argument("--latency", help="Seconds taken by the stub resolvers to answer in the end-to-end "
+                        "benchmarks (default is 0.001)", type=float, default=0.001)
+    parser.add_argument("--output", "-o", help="JSON file where the results are saved", type=str)
+    parser.add_argument("--compare", help="JSON file of previous results, printed as ratios", type=str)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.words, args.queries, args.concurrency, args.latency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
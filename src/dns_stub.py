@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from subdomain_bruteforce import DNSMessage, TokenBucket
+
+
+class StubZone(object):
+    """The records answered by the stub server, by name and record type.
+
+    A zone maps every name to its A addresses, or to its records by type name, e.g.
+    {"maps.example.com": ["10.0.0.1"], "www.example.com": {"CNAME": ["maps.example.com"]}}.
+    A name starting with "*." is a wildcard answering for the names under it which are not in the zone."""
+
+    TYPES = {name: record_type for record_type, name in DNSMessage.TYPE_NAMES.items()}
+
+    def __init__(self, records: Dict[str, Union[List[str], Dict[str, List[str]]]], ttl: int = 300):
+        self.ttl = ttl
+        self.records: Dict[str, Dict[int, List[str]]] = {}
+        for name, values in records.items():
+            if not isinstance(values, dict):
+                values = {"A": values}
+            self.records[name.lower().rstrip(".")] = {StubZone.TYPES[record_type]: list(addresses)
+                                                      for record_type, addresses in values.items()}
+
+    def find(self, name: str) -> Optional[Dict[int, List[str]]]:
+        """Returns the records of the name, or of the closest wildcard above it, None if the name does not exist"""
+
+        name = name.lower().rstrip(".")
+        if name in self.records:
+            return self.records[name]
+        labels = name.split(".")
+        for i in range(1, len(labels)):
+            wildcard = ".".join(["*"] + labels[i:])
+            if wildcard in self.records:
+                return self.records[wildcard]
+        return None
+
+    def answer(self, name: str, query_type: int) -> Tuple[int, List[Tuple[str, int, str]]]:
+        """Returns the response code and the records (name, type, value) answering the query, following the CNAME
+        records in the zone"""
+
+        records, owner = [], None  # the owner of the records, None for the question name
+        for _ in range(8):  # a bounded number of steps avoids loops of CNAME records
+            found = self.find(name)
+            if found is None:  # a dangling CNAME record is answered anyway
+                return (DNSMessage.NXDOMAIN if not records else DNSMessage.NOERROR), records
+            if query_type != DNSMessage.CNAME and DNSMessage.CNAME in found:
+                name = found[DNSMessage.CNAME][0]
+                records.append((owner, DNSMessage.CNAME, name))
+                owner = name
+                continue
+            records += [(owner, query_type, value) for value in found.get(query_type, [])]
+            break
+        return DNSMessage.NOERROR, records
+
+
+class StubDNSServer(object):
+    """An in-process DNS server answering the queries from a zone over UDP and TCP, for offline tests and benchmarks.
+
+    It runs its own asyncio loop in a daemon thread, so it can serve the engines of the Model running in the same
+    process. The responses can be delayed by latency seconds plus a random jitter, a ratio of the UDP queries can be
+    dropped, and a client sending more than ban_rate queries per second (bursts of ban_rate) is banned: its queries
+    are dropped for ban seconds."""
+
+    def __init__(self, zone: Union[StubZone, dict], host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, loss: float = 0.0, ban_rate: float = None, ban: float = 10.0):
+        self.zone = zone if isinstance(zone, StubZone) else StubZone(zone)
+        self.host, self.port = host, port
+        self.latency, self.jitter, self.loss = latency, jitter, loss
+        self.ban_rate, self.ban = ban_rate, ban
+        self.buckets: Dict[str, TokenBucket] = {}           # queries per second of every client
+        self.banned_until: Dict[str, float] = {}            # end of the ban of every banned client
+        self.queries, self.dropped = 0, 0                   # number of queries received and of the ones dropped
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.udp_transport: Optional[asyncio.DatagramTransport] = None
+        self.tcp_server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """The address of the server, with the port chosen by the system if port was 0"""
+
+        return self.host, self.port
+
+    def start(self) -> "StubDNSServer":
+        """Starts serving the UDP and TCP queries on the same port"""
+
+        ready = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.open())
+            ready.set()
+            self.loop.run_forever()
+            self.udp_transport.close()
+            self.tcp_server.close()
+            self.loop.run_until_complete(self.tcp_server.wait_closed())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    async def open(self) -> None:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self.udp_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: StubProtocol(self), local_addr=(self.host, self.port), family=family)
+        self.port = self.udp_transport.get_extra_info("sockname")[1]
+        self.tcp_server = await asyncio.start_server(self.tcp_connection, self.host, self.port, family=family)
+
+    def close(self) -> None:
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def __enter__(self) -> "StubDNSServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def banned(self, client: str) -> bool:
+        """Counts a query of the client and returns True if it is banned"""
+
+        if self.ban_rate is None:
+            return False
+        now = time.monotonic()
+        if self.banned_until.get(client, 0) > now:
+            return True
+        bucket = self.buckets.setdefault(client, TokenBucket(self.ban_rate))
+        if bucket.available() < 1:
+            self.banned_until[client] = now + self.ban
+            self.buckets.pop(client)
+            return True
+        bucket.reserve()
+        return False
+
+    def respond(self, query: bytes, client: str, send: callable, udp: bool) -> None:
+        """Sends the response to the query after the latency, unless the query is dropped"""
+
+        self.queries += 1
+        if self.banned(client) or (udp and self.loss and random.random() < self.loss):
+            self.dropped += 1
+            return
+        try:
+            response = self.response(query)
+        except (IndexError, struct.error, ValueError):  # malformed query
+            self.dropped += 1
+            return
+
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            self.loop.call_later(delay, send, response)
+        else:
+            send(response)
+
+    def response(self, query: bytes) -> bytes:
+        """Builds the response to a query packet"""
+
+        query_id, flags = struct.unpack_from("!HH", query)
+        name, offset = DNSMessage.read_name(query, 12)
+        query_type = struct.unpack_from("!H", query, offset)[0]
+        question = query[12:offset + 4]
+        rcode, records = self.zone.answer(name, query_type)
+
+        answers = b""
+        for owner, record_type, value in records:
+            if record_type == DNSMessage.CNAME:
+                data = StubDNSServer.encode_name(value)
+            else:
+                data = socket.inet_pton(socket.AF_INET6 if record_type == DNSMessage.AAAA else socket.AF_INET, value)
+            owner = b"\xc0\x0c" if owner is None else StubDNSServer.encode_name(owner)  # a pointer to the question
+            answers += owner + struct.pack("!HHIH", record_type, 1, self.zone.ttl, len(data)) + data
+
+        header = struct.pack("!HHHHHH", query_id, 0x8180 | (flags & 0x0100) | rcode, 1, len(records), 0, 0)
+        return header + question + answers
+
+    @staticmethod
+    def encode_name(name: str) -> bytes:
+        return b"".join(bytes([len(label)]) + label.encode() for label in name.rstrip(".").split(".")) + b"\x00"
+
+    async def tcp_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers the queries of a TCP connection, each one prefixed by its length"""
+
+        client = writer.get_extra_info("peername")[0]
+
+        def send(response: bytes) -> None:
+            if not writer.is_closing():
+                writer.write(struct.pack("!H", len(response)) + response)
+
+        try:
+            while True:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+                self.respond(await reader.readexactly(length), client, send, udp=False)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class StubProtocol(asyncio.DatagramProtocol):
+    """Passes every datagram received by the UDP socket to the stub server"""
+
+    def __init__(self, server: StubDNSServer):
+        self.server = server
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.server.respond(data, addr[0], lambda response: self.server.udp_transport.sendto(response, addr), udp=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A stub DNS server answering from a zone file, for offline tests")
+    parser.add_argument("zone", help="JSON file mapping every name to its A addresses, or to its records by type",
+                        type=str)
+    parser.add_argument("--host", help="Address to listen on (default is 127.0.0.1)", type=str, default="127.0.0.1")
+    parser.add_argument("--port", "-p", help="UDP and TCP port to listen on (default is 5353)", type=int, default=5353)
+    parser.add_argument("--latency", help="Seconds before every response", type=float, default=0.0)
+    parser.add_argument("--jitter", help="Maximum random seconds added to the latency", type=float, default=0.0)
+    parser.add_argument("--loss", help="Ratio of the UDP queries dropped", type=float, default=0.0)
+    parser.add_argument("--ban-rate", help="Queries per second of a client before it is banned", type=float)
+    parser.add_argument("--ban", help="Seconds of a ban (default is 10)", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.zone, "r") as f:
+        zone = json.load(f)
+    server = StubDNSServer(zone, args.host, args.port, args.latency, args.jitter, args.loss, args.ban_rate, args.ban)
+    with server:
+        print("Serving on %s:%d. Press ENTER to stop..." % server.address)
+        input()
+    print(f"{server.queries} queries, {server.dropped} dropped")
+
+
+if __name__ == "__main__":
+    main()
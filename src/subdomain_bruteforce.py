@@ -1,11 +1,1065 @@
 import argparse
+import asyncio
+import bisect
+import bz2
+import collections
 import datetime
+import enum
+import gzip
+import hashlib
+import heapq
+import http.server
+import io
+import ipaddress
 import itertools
+import json
+import logging
+import lzma
+import mmap
+import os
+import queue
+import random
+import re
 import socket
+import sqlite3
 import string
+import struct
 import threading
 import time
-from typing import Iterable, Optional, List, Set
+from typing import BinaryIO, Iterable, Optional, List, Set, Tuple, Dict, NamedTuple
+
+try:
+    import zstandard
+except ImportError:  # zstd wordlists are supported only if the zstandard package is installed
+    zstandard = None
+
+logger = logging.getLogger("subdomain_bruteforce")
+
+
+class DNSMessage(object):
+    """This class builds DNS query packets and parses DNS response packets (RFC 1035)"""
+
+    A, CNAME, SOA, AAAA = 1, 5, 6, 28               # supported record types
+    TYPE_NAMES = {A: "A", CNAME: "CNAME", SOA: "SOA", AAAA: "AAAA"}
+    NOERROR, SERVFAIL, NXDOMAIN = 0, 2, 3           # response codes
+
+    @staticmethod
+    def build_query(query_id: int, domain: str, query_type: int = A) -> bytes:
+        """Returns a recursive query packet asking the query_type records of the domain"""
+
+        header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)  # RD flag set, one question
+        labels = b"".join(bytes([len(label)]) + label for label in domain.rstrip(".").encode("idna").split(b"."))
+        return header + labels + b"\x00" + struct.pack("!HH", query_type, 1)  # class IN
+
+    @staticmethod
+    def read_name(data: bytes, offset: int) -> Tuple[str, int]:
+        """Reads a possibly compressed domain name and returns it with the offset of the next field"""
+
+        labels: List[str] = []
+        end: Optional[int] = None  # offset after the first compression pointer
+        for _ in range(128):  # a bounded number of steps avoids loops of compression pointers
+            length = data[offset]
+            if length & 0xC0 == 0xC0:  # compression pointer to a previous name
+                if end is None:
+                    end = offset + 2
+                offset = ((length & 0x3F) << 8) | data[offset + 1]
+                continue
+            offset += 1
+            if length == 0:
+                return ".".join(labels), offset if end is None else end
+            labels.append(data[offset:offset + length].decode("ascii", "replace"))
+            offset += length
+        raise ValueError("Too many labels or compression pointers")
+
+    @staticmethod
+    def read_record(data: bytes, offset: int) -> Tuple[Tuple[str, int, int, str], int]:
+        """Reads a resource record as (name, type, ttl, value) and returns it with the offset of the next one.
+
+        The ttl of a SOA record is its negative caching TTL (RFC 2308) and its value is the primary nameserver"""
+
+        name, offset = DNSMessage.read_name(data, offset)
+        record_type, _, ttl, length = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        if record_type == DNSMessage.A:
+            value = socket.inet_ntop(socket.AF_INET, data[offset:offset + length])
+        elif record_type == DNSMessage.AAAA:
+            value = socket.inet_ntop(socket.AF_INET6, data[offset:offset + length])
+        elif record_type == DNSMessage.CNAME:
+            value = DNSMessage.read_name(data, offset)[0]
+        elif record_type == DNSMessage.SOA:
+            value, end = DNSMessage.read_name(data, offset)
+            end = DNSMessage.read_name(data, end)[1]  # mailbox of the administrator
+            ttl = min(ttl, struct.unpack_from("!IIIII", data, end)[4])
+        else:
+            value = data[offset:offset + length].hex()
+        return (name, record_type, ttl, value), offset + length
+
+    @staticmethod
+    def parse_response(data: bytes) -> Tuple[int, int, str, List[Tuple[str, int, int, str]]]:
+        """Parses a response packet.
+
+        Returns the query id, the response code, the question name and the records of the answer and authority
+        sections as (name, type, ttl, value)"""
+
+        query_id, flags, question_count, answer_count, authority_count, _ = struct.unpack_from("!HHHHHH", data)
+        offset, question = 12, ""
+        for _ in range(question_count):
+            question, offset = DNSMessage.read_name(data, offset)
+            offset += 4  # type and class
+
+        records = []
+        for _ in range(answer_count + authority_count):
+            record, offset = DNSMessage.read_record(data, offset)
+            records.append(record)
+
+        return query_id, flags & 0x000F, question, records
+
+
+class Outcome(enum.Enum):
+    """The outcome of a lookup"""
+
+    NOERROR = "NOERROR"         # the domain has records of the queried types
+    NODATA = "NODATA"           # the domain exists, without records of the queried types
+    NXDOMAIN = "NXDOMAIN"       # the domain does not exist
+    SERVFAIL = "SERVFAIL"       # the nameserver failed to answer, the lookup can be retried
+    TIMEOUT = "TIMEOUT"         # no response arrived in time, the lookup can be retried
+
+
+class ResolveError(Exception):
+    """Raised when a lookup fails without a definitive answer, e.g. on timeouts or server failures"""
+
+    def __init__(self, message: str = "", outcome: Outcome = Outcome.SERVFAIL, resolver: str = None):
+        super().__init__(message)
+        self.outcome = outcome      # SERVFAIL or TIMEOUT
+        self.resolver = resolver    # the resolver which failed, like Answer.resolver
+
+
+class Answer(NamedTuple):
+    """The answer of a resolver for a domain"""
+
+    addresses: List[str]                # the resolved IPv4 and IPv6 addresses, empty if the domain does not exist
+    ttl: Optional[int] = None           # seconds the answer can be cached for, None if unknown
+    records: Tuple[Tuple[str, int, Optional[int], str], ...] = ()  # A, AAAA and CNAME records (name, type, ttl, value)
+    resolver: Optional[str] = None      # the resolver which answered, e.g. the address of the nameserver
+    latency: Optional[float] = None     # seconds taken by the lookup, None if the answer was not looked up
+    outcome: Outcome = Outcome.NOERROR  # NOERROR, NODATA or NXDOMAIN
+
+    @property
+    def targets(self) -> List[str]:
+        """The addresses, or the targets of the CNAME records if there is none, e.g. for a dangling CNAME.
+        The domain exists if there is any target"""
+
+        return self.addresses or [value for _, record_type, _, value in self.records if record_type == DNSMessage.CNAME]
+
+
+class Resolver(object):
+    """Base class of the blocking resolvers, called by the Model from a pool of threads"""
+
+    def open(self) -> None:
+        """Prepares the resolver before the first lookup"""
+
+    def close(self) -> None:
+        """Releases the resources of the resolver after the last lookup"""
+
+    def resolve(self, domain: str) -> Answer:
+        """Returns the answer with the addresses of the domain, with no addresses if it does not exist.
+
+        Raises ResolveError if the existence of the domain cannot be determined"""
+
+        raise NotImplementedError
+
+    def status(self) -> dict:
+        """Returns the statistics of the resolver for the current status"""
+
+        return {}
+
+
+class AsyncResolver(object):
+    """Base class of the non-blocking resolvers, awaited by the Model from a single asyncio loop"""
+
+    async def open(self) -> None:
+        """Prepares the resolver before the first lookup, from the running event loop"""
+
+    def close(self) -> None:
+        """Releases the resources of the resolver after the last lookup"""
+
+    async def resolve(self, domain: str) -> Answer:
+        """Same as Resolver.resolve"""
+
+        raise NotImplementedError
+
+    def status(self) -> dict:
+        """Same as Resolver.status"""
+
+        return {}
+
+
+class SystemResolver(Resolver):
+    """Resolves domains with the resolver of the operating system: the A records with socket.gethostbyname_ex,
+    the AAAA records with socket.getaddrinfo. It cannot look up the CNAME records alone."""
+
+    def __init__(self, types: Tuple[int, ...] = (DNSMessage.A,)):
+        self.types = types  # A and AAAA, looked up one after the other
+
+    def resolve(self, domain: str) -> Answer:
+        records, outcome = [], Outcome.NXDOMAIN
+        for query_type in self.types:
+            try:
+                if query_type == DNSMessage.AAAA:
+                    infos = socket.getaddrinfo(domain, None, socket.AF_INET6, socket.SOCK_STREAM, 0,
+                                               socket.AI_CANONNAME)
+                    name, addresses = infos[0][3] or domain, [info[4][0] for info in infos]
+                else:
+                    name, _, addresses = socket.gethostbyname_ex(domain)
+            except socket.gaierror as e:  # an exception is thrown if the domain is not resolved
+                if e.errno == socket.EAI_AGAIN:  # temporary failure of the name server, a timeout or a SERVFAIL
+                    raise ResolveError(f"{domain}: {e.strerror}", Outcome.SERVFAIL, "system") from e
+                if e.errno == getattr(socket, "EAI_NODATA", None):  # the domain exists without records of the type
+                    outcome = Outcome.NODATA
+                continue
+
+            # the system resolver provides the canonical name but not the TTLs
+            if name.lower() != domain.lower():
+                records.append((domain, DNSMessage.CNAME, None, name))
+            records += [(name, query_type, None, address) for address in addresses]
+
+        records = list(dict.fromkeys(records))  # the canonical name is found by every query
+        addresses = [value for _, record_type, _, value in records if record_type != DNSMessage.CNAME]
+        return Answer(addresses, records=tuple(records), resolver="system",
+                      outcome=Outcome.NOERROR if records else outcome)
+
+
+class MemoryResolver(Resolver):
+    """Resolves domains from a dictionary without any network access, useful for tests and benchmarks"""
+
+    def __init__(self, records: Dict[str, List[str]], latency: float = 0.0):
+        self.records, self.latency = records, latency  # addresses by domain, seconds to wait before answering
+
+    def resolve(self, domain: str) -> Answer:
+        if self.latency:
+            time.sleep(self.latency)
+        addresses = list(self.records.get(domain, []))
+        return Answer(addresses, records=tuple((domain, DNSMessage.A, None, address) for address in addresses),
+                      resolver="memory", outcome=Outcome.NOERROR if addresses else Outcome.NXDOMAIN)
+
+
+class TokenBucket(object):
+    """Limits a rate of queries per second, allowing bursts of at most burst queries.
+
+    A query reserves a token and waits the returned delay, so the bucket is shared by threads and asyncio tasks."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate, self.burst = rate, burst or max(1.0, rate)  # by default, a burst of one second of queries
+        self.tokens: float = self.burst                         # negative when tokens are reserved in advance
+        self.updated: float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def available(self) -> float:
+        """Returns the number of tokens which can be reserved without waiting"""
+
+        with self.lock:
+            return min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+
+    def reserve(self) -> float:
+        """Takes a token and returns the seconds to wait before using it"""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - 1
+            self.updated = now
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self) -> None:
+        """Takes a token, sleeping until it is available"""
+
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class Nameserver(object):
+    """A nameserver of the pool with its health statistics"""
+
+    def __init__(self, address: Tuple[str, int], bucket: TokenBucket = None):
+        self.address, self.bucket = address, bucket  # the bucket limits the queries per second to this nameserver
+        self.queries, self.errors = 0, 0        # total number of queries and of failed ones
+        self.latency: Optional[float] = None    # moving average of the response time in seconds
+        self.error_rate: float = 0.0            # moving average of the failures
+        self.demoted_until: float = 0.0         # monotonic time until the nameserver is not used
+        self.lying: bool = False                # answers for domains which do not exist
+        self.family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+
+    @staticmethod
+    def parse_address(text: str, default_port: int = 53) -> Tuple[str, int]:
+        """Parses an IP address with an optional port, e.g. 1.1.1.1, 1.1.1.1:5353, 2606:4700::1111, [::1]:5353"""
+
+        host, port = text.strip(), default_port
+        if host.startswith("["):  # bracketed IPv6 address
+            host, _, rest = host[1:].partition("]")
+            port = int(rest[1:]) if rest.startswith(":") else default_port
+        elif host.count(":") == 1:  # IPv4 address with port
+            host, port = host.split(":")
+            port = int(port)
+        return ipaddress.ip_address(host).compressed, port
+
+    def status(self) -> dict:
+        return {
+            "queries": self.queries,
+            "errors": self.errors,
+            "latency ms": None if self.latency is None else round(self.latency * 1000, 1),
+            "demoted": self.lying or self.demoted_until > time.monotonic(),
+        }
+
+
+class NameserverPool(object):
+    """Spreads the queries over the nameservers round-robin, skipping the demoted ones and the ones out of tokens.
+
+    A nameserver is demoted for a while if its error rate or its latency compared with the others gets too high,
+    and forever if it answers for domains which do not exist."""
+
+    def __init__(self, addresses: Iterable[Tuple[str, int]], max_error_rate: float = 0.3,
+                 max_latency_ratio: float = 4.0, demotion: float = 30.0, rate: float = None, burst: float = None):
+        self.nameservers = [Nameserver(address, TokenBucket(rate, burst) if rate else None) for address in addresses]
+        if not self.nameservers:
+            raise ValueError("No nameserver provided")
+        self.max_error_rate, self.max_latency_ratio, self.demotion = max_error_rate, max_latency_ratio, demotion
+        self.cycle = itertools.cycle(self.nameservers)
+
+    def next(self) -> Nameserver:
+        """Returns the next healthy nameserver with a token available, else the healthy one with more tokens,
+        or the one closest to the end of its demotion if all are demoted"""
+
+        now = time.monotonic()
+        waiting: Optional[Nameserver] = None  # the healthy nameserver which will have a token first
+        for _ in range(len(self.nameservers)):
+            nameserver = next(self.cycle)
+            if not nameserver.lying and nameserver.demoted_until <= now:
+                if nameserver.bucket is None or nameserver.bucket.available() >= 1:
+                    return nameserver
+                if waiting is None or nameserver.bucket.available() > waiting.bucket.available():
+                    waiting = nameserver
+        if waiting is not None:
+            return waiting
+
+        candidates = [nameserver for nameserver in self.nameservers if not nameserver.lying] or self.nameservers
+        return min(candidates, key=lambda nameserver: nameserver.demoted_until)
+
+    def report(self, nameserver: Nameserver, latency: Optional[float], error: bool) -> None:
+        """Updates the statistics of the nameserver after a query and demotes it if it is unhealthy"""
+
+        nameserver.queries += 1
+        nameserver.errors += error
+        nameserver.error_rate += 0.05 * (error - nameserver.error_rate)
+        if latency is not None and nameserver.latency is None:
+            nameserver.latency = latency
+        elif latency is not None:
+            nameserver.latency += 0.05 * (latency - nameserver.latency)
+
+        if nameserver.queries < 20:  # not enough data yet
+            return
+
+        latencies = sorted(ns.latency for ns in self.nameservers if ns.latency is not None)
+        median = latencies[(len(latencies) - 1) // 2] if latencies else None
+        too_slow = len(latencies) > 1 and nameserver.latency is not None \
+            and nameserver.latency > self.max_latency_ratio * median
+
+        if nameserver.error_rate > self.max_error_rate or too_slow:
+            nameserver.demoted_until = time.monotonic() + self.demotion
+            nameserver.error_rate /= 2  # give it a new chance after the demotion
+            if too_slow:
+                nameserver.latency = median
+
+    def status(self) -> dict:
+        return {"%s:%d" % nameserver.address: nameserver.status() for nameserver in self.nameservers}
+
+
+class DNSProtocol(asyncio.DatagramProtocol):
+    """Passes every datagram received by a UDP socket to the resolver"""
+
+    def __init__(self, resolver: "UDPResolver", index: int):
+        self.resolver, self.index = resolver, index
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.resolver.response_received(self.index, data, addr)
+
+
+class UDPResolver(AsyncResolver):
+    """This class resolves domains sending raw DNS queries over UDP from an asyncio event loop.
+
+    Thousands of in-flight queries are multiplexed over a few sockets and spread over a pool of nameservers,
+    each response is matched to its query by socket, query id and sender.
+    Unlike socket.gethostbyname, it tells NXDOMAIN apart from a timeout."""
+
+    def __init__(self, nameservers: List[Tuple[str, int]] = None, sockets: int = 4, timeout: float = 2.0,
+                 canary_domain: str = "example.com", rate: float = None, burst: float = None,
+                 types: Tuple[int, ...] = (DNSMessage.A,)):
+        self.pool = NameserverPool(nameservers or [(UDPResolver.system_nameserver(), 53)], rate=rate, burst=burst)
+        self.socket_count, self.timeout, self.canary_domain = sockets, timeout, canary_domain
+        self.types = types  # record types queried at once for every domain
+        self.failed_nameservers: Dict[str, Nameserver] = collections.OrderedDict()  # by domain, to retry elsewhere
+        self.transports: List[asyncio.DatagramTransport] = []
+        self.sockets_by_family: Dict[int, List[int]] = {}  # indexes of the transports for each address family
+        self.pending: Dict[Tuple[int, int], Tuple[str, Nameserver, asyncio.Future]] = {}  # by socket and query id
+
+    @staticmethod
+    def system_nameserver(resolv_conf: str = "/etc/resolv.conf") -> str:
+        """Returns the first nameserver configured in the system, Google public DNS if there is none"""
+
+        try:
+            with open(resolv_conf, "r") as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[0] == "nameserver":
+                        return fields[1]
+        except OSError:
+            pass
+        return "8.8.8.8"
+
+    async def open(self) -> None:
+        """Creates the UDP sockets and looks for nameservers answering for domains which do not exist"""
+
+        loop = asyncio.get_running_loop()
+        for family in {nameserver.family for nameserver in self.pool.nameservers}:
+            for _ in range(self.socket_count):
+                index = len(self.transports)
+                transport, _ = await loop.create_datagram_endpoint(lambda: DNSProtocol(self, index), family=family)
+                self.transports.append(transport)
+                self.sockets_by_family.setdefault(family, []).append(index)
+
+        if len(self.pool.nameservers) > 1:
+            await asyncio.gather(*(self.check_lying(nameserver) for nameserver in self.pool.nameservers))
+
+    def close(self) -> None:
+        for transport in self.transports:
+            transport.close()
+        self.transports, self.sockets_by_family = [], {}
+
+    async def check_lying(self, nameserver: Nameserver) -> None:
+        """Marks the nameserver as lying if it resolves a random subdomain of the canary domain"""
+
+        label = "".join(random.choice(string.ascii_lowercase) for _ in range(20))
+        try:
+            rcode, records = await self.query(f"{label}.{self.canary_domain}", nameserver=nameserver)
+            nameserver.lying = any(record[1] == DNSMessage.A for record in records)
+        except asyncio.TimeoutError:
+            pass
+
+    def response_received(self, index: int, data: bytes, addr: tuple) -> None:
+        """Resolves the future of the query matching the response, ignoring unknown or malformed packets"""
+
+        try:
+            query_id, rcode, question, records = DNSMessage.parse_response(data)
+        except (ValueError, IndexError, struct.error):
+            return
+
+        name, nameserver, future = self.pending.get((index, query_id), (None, None, None))
+        if future is not None and not future.done() and question.lower() == name \
+                and (ipaddress.ip_address(addr[0]).compressed, addr[1]) == nameserver.address:
+            future.set_result((rcode, records))
+
+    async def query(self, domain: str, query_type: int = DNSMessage.A,
+                    nameserver: Nameserver = None) -> Tuple[int, list]:
+        """Sends a query to the nameserver, by default the next one of the pool, and returns the response code
+        and the records.
+
+        Raises asyncio.TimeoutError if no response arrives within the timeout"""
+
+        nameserver = nameserver or self.pool.next()
+        if nameserver.bucket is not None:
+            delay = nameserver.bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+        index = random.choice(self.sockets_by_family[nameserver.family])
+        query_id = random.getrandbits(16)
+        while (index, query_id) in self.pending:
+            query_id = random.getrandbits(16)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # the name as sent in the question, IDNA-encoded, is compared with the question of the response
+        name = domain.rstrip(".").lower() if domain.isascii() else domain.rstrip(".").encode("idna").decode().lower()
+        self.pending[(index, query_id)] = (name, nameserver, future)
+        start = loop.time()
+        try:
+            self.transports[index].sendto(DNSMessage.build_query(query_id, domain, query_type), nameserver.address)
+            rcode, records = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.pool.report(nameserver, None, True)
+            raise
+        finally:
+            del self.pending[(index, query_id)]
+
+        self.pool.report(nameserver, loop.time() - start, rcode not in (DNSMessage.NOERROR, DNSMessage.NXDOMAIN))
+        return rcode, records
+
+    async def resolve(self, domain: str) -> Answer:
+        """Returns the addresses in the A and AAAA records of the domain, with the lowest TTL of the records.
+
+        A query for every record type is sent at once to the same nameserver, and their records are merged.
+        A domain whose latest lookup failed is looked up on another nameserver of the pool, if there is one."""
+
+        nameserver = self.pool.next()
+        if self.failed_nameservers.pop(domain, None) is nameserver and len(self.pool.nameservers) > 1:
+            nameserver = self.pool.next()
+
+        responses = await asyncio.gather(*(self.query(domain, query_type, nameserver) for query_type in self.types),
+                                         return_exceptions=True)
+        records, rcodes = [], set()
+        for response in responses:
+            if isinstance(response, asyncio.TimeoutError):
+                self.lookup_failed(domain, nameserver)
+                raise ResolveError(f"{domain}: timeout", Outcome.TIMEOUT, "%s:%d" % nameserver.address) from response
+            if isinstance(response, BaseException):
+                raise response
+            rcode, response_records = response
+            if rcode not in (DNSMessage.NOERROR, DNSMessage.NXDOMAIN):
+                self.lookup_failed(domain, nameserver)
+                raise ResolveError(f"{domain}: response code {rcode}", Outcome.SERVFAIL, "%s:%d" % nameserver.address)
+            records += response_records
+            rcodes.add(rcode)
+
+        records = list(dict.fromkeys(records))  # e.g. the CNAME records are in the response of every query
+        addresses = [record[3] for record in records if record[1] in (DNSMessage.A, DNSMessage.AAAA)]
+        answers = tuple(record for record in records if record[1] in (DNSMessage.A, DNSMessage.AAAA, DNSMessage.CNAME))
+        if answers:
+            outcome = Outcome.NOERROR
+        else:
+            outcome = Outcome.NXDOMAIN if rcodes == {DNSMessage.NXDOMAIN} else Outcome.NODATA
+        return Answer(addresses, min((record[2] for record in records), default=None), answers,
+                      "%s:%d" % nameserver.address, outcome=outcome)
+
+    def lookup_failed(self, domain: str, nameserver: Nameserver) -> None:
+        """Remembers the nameserver which failed to resolve the domain, to retry the lookup on another one"""
+
+        self.failed_nameservers[domain] = nameserver
+        if len(self.failed_nameservers) > 100_000:  # the domains given up are never looked up again
+            self.failed_nameservers.popitem(last=False)
+
+    def status(self) -> dict:
+        return self.pool.status()
+
+
+class AIMDLimiter(object):
+    """Adapts the number of in-flight queries with additive increase and multiplicative decrease (AIMD).
+
+    The window starts small and grows by one query per success (slow start) until the first congestion signal,
+    then by one query per round trip. Timeouts, server failures and a latency rising over latency_factor times its
+    long-term average are congestion signals: they cut the window by the decrease factor, at most once per round trip.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, initial: int = 10, decrease: float = 0.5,
+                 latency_factor: float = 2.0):
+        self.minimum, self.maximum, self.decrease, self.latency_factor = minimum, maximum, decrease, latency_factor
+        self.window: float = float(max(minimum, min(initial, maximum)))
+        self.slow_start: bool = True
+        self.in_flight: int = 0                         # queries currently allowed by acquire
+        self.latency: Optional[float] = None            # short-term moving average of the latency
+        self.long_latency: Optional[float] = None       # long-term moving average of the latency
+        self.samples: int = 0                           # number of latencies recorded
+        self.last_decrease: float = 0.0                 # monotonic time of the latest cut of the window
+        self.condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current number of queries allowed in flight"""
+
+        return int(self.window)
+
+    def acquire(self) -> None:
+        """Waits until the number of in-flight queries is under the window, then takes a slot"""
+
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """Frees the slot taken by acquire"""
+
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def record(self, success: bool, latency: float = None) -> None:
+        """Updates the window with the outcome of a query"""
+
+        with self.condition:
+            congested = not success
+            if latency is not None:
+                self.samples += 1
+                if self.latency is None:
+                    self.latency = self.long_latency = latency
+                self.latency += 0.1 * (latency - self.latency)
+                self.long_latency += 0.01 * (latency - self.long_latency)
+                congested = congested or (self.samples > 100 and self.latency > self.latency_factor * self.long_latency)
+
+            if not congested:
+                self.window = min(self.maximum, self.window + (1 if self.slow_start else 1 / self.window))
+                self.condition.notify()
+            elif time.monotonic() - self.last_decrease >= (self.latency or 0.1):
+                self.window = max(self.minimum, self.window * self.decrease)
+                self.slow_start = False
+                self.last_decrease = time.monotonic()
+
+
+class HealthProbe(object):
+    """Decides when the base domain must be probed to check if the resolvers are still working.
+
+    The lookups of the bruteforce feed a moving average of their failures. The base domain is probed only while
+    it stays over the threshold, at most once per interval, so a healthy run sends no probes at all.
+    """
+
+    def __init__(self, interval: float = 5.0, threshold: float = 0.5):
+        self.interval, self.threshold = interval, threshold
+        self.error_rate: float = 0.0                # moving average of the failed lookups
+        self.last_probe: Optional[float] = None     # monotonic time of the latest probe
+        self.lock = threading.Lock()
+
+    def record(self, success: bool) -> None:
+        """Updates the error rate with the outcome of a lookup"""
+
+        with self.lock:
+            self.error_rate += 0.05 * ((not success) - self.error_rate)
+
+    def due(self) -> bool:
+        """Returns True if the base domain was never probed, or if the error rate is high and the interval elapsed"""
+
+        return self.last_probe is None or \
+            (self.error_rate > self.threshold and time.monotonic() - self.last_probe >= self.interval)
+
+    def probed(self, working: bool) -> None:
+        """Records a probe, resetting the error rate if the base domain resolves"""
+
+        with self.lock:
+            self.last_probe = time.monotonic()
+            if working:
+                self.error_rate = 0.0
+
+
+class RetryScheduler(object):
+    """Schedules the lookups to make again after a failure, with an exponential backoff and a random jitter.
+
+    The delay before the attempt n is a random number of seconds up to base_delay * 2 ** (n - 2), at most max_delay
+    (full jitter), so the retries of a burst of failures are spread over time. The scheduled lookups are kept in a
+    heap by due time: the dispatcher takes the due ones without waiting for the others."""
+
+    def __init__(self, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.base_delay, self.max_delay = base_delay, max_delay
+        self.heap: List[Tuple[float, int, int, str, int]] = []   # (due time, sequence, index, subdomain, attempt)
+        self.sequence = itertools.count()                       # orders the lookups due at the same time
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def schedule(self, index: int, subdomain: str, attempt: int) -> None:
+        """Schedules the attempt, counting from 1, of the lookup of the subdomain"""
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 2)))
+        with self.lock:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.sequence), index, subdomain, attempt))
+
+    def due(self) -> Iterable[Tuple[int, str, int]]:
+        """Takes the lookups whose time has come, as (index, subdomain, attempt)"""
+
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.heap or self.heap[0][0] > now:
+                    return
+                retry = heapq.heappop(self.heap)[2:]
+            yield retry
+
+    def delay(self) -> float:
+        """Returns the seconds until the next lookup is due, 0 if there is none"""
+
+        with self.lock:
+            return max(0.0, self.heap[0][0] - time.monotonic()) if self.heap else 0.0
+
+
+class LatencyHistogram(object):
+    """Counts the latencies in buckets of logarithmic width, from 0.1 ms to about 2 minutes.
+
+    Every bucket is 25% wider than the previous one, so a quantile is known within 25% whatever the latency,
+    and a latency is recorded with a binary search over the fixed bounds, without keeping the samples."""
+
+    BOUNDS = [0.0001 * 1.25 ** i for i in range(64)]    # upper bounds of the buckets in seconds, the last one is +Inf
+
+    def __init__(self):
+        self.counts = [0] * (len(LatencyHistogram.BOUNDS) + 1)
+        self.count, self.sum = 0, 0.0
+
+    def record(self, latency: float) -> None:
+        self.counts[bisect.bisect_left(LatencyHistogram.BOUNDS, latency)] += 1
+        self.count += 1
+        self.sum += latency
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Returns the upper bound of the bucket of the q-quantile (0 < q <= 1), None if nothing was recorded"""
+
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return LatencyHistogram.BOUNDS[i] if i < len(LatencyHistogram.BOUNDS) else float("inf")
+        return float("inf")
+
+    def status(self) -> dict:
+        """Returns the number of latencies and their mean, median, 90th and 99th percentiles in milliseconds"""
+
+        def milliseconds(seconds: Optional[float]) -> Optional[float]:
+            return round(seconds * 1000, 1) if seconds is not None else None
+
+        return {
+            "count": self.count,
+            "mean": milliseconds(self.sum / self.count if self.count else None),
+            "p50": milliseconds(self.quantile(0.5)),
+            "p90": milliseconds(self.quantile(0.9)),
+            "p99": milliseconds(self.quantile(0.99)),
+        }
+
+
+class RateWindow(object):
+    """Counts events in one-second slots over a sliding window, to measure their current rate rather than the
+    average since the start"""
+
+    def __init__(self, seconds: int = 10):
+        self.counts = [0] * seconds     # events of every slot
+        self.seconds = [0] * seconds    # second of every slot, a slot is reset when reused for a later second
+
+    def add(self, count: int = 1) -> None:
+        second = int(time.monotonic())
+        slot = second % len(self.counts)
+        if self.seconds[slot] != second:
+            self.seconds[slot], self.counts[slot] = second, 0
+        self.counts[slot] += count
+
+    def rate(self) -> float:
+        """Returns the events per second over the window, the current second included"""
+
+        now = int(time.monotonic())
+        return sum(count for count, second in zip(self.counts, self.seconds)
+                   if now - second < len(self.counts)) / len(self.counts)
+
+
+class Metrics(object):
+    """Instrumentation of the lookups: the number of lookups by outcome, the histogram of their latencies, overall
+    and by resolver, and their rate over a sliding window.
+
+    Recording a lookup takes a lock, a binary search and a few additions, cheap enough for every lookup."""
+
+    def __init__(self, window: int = 10):
+        self.outcomes: Dict[Outcome, int] = dict.fromkeys(Outcome, 0)  # number of lookups by outcome
+        self.latency = LatencyHistogram()                               # latencies of all the lookups
+        self.resolvers: Dict[str, LatencyHistogram] = {}                # latencies of the lookups by resolver
+        self.resolver_failures: Dict[str, int] = {}                     # failed lookups by resolver
+        self.rate = RateWindow(window)                                  # lookups of the latest seconds
+        self.lock = threading.Lock()
+
+    def record(self, resolver: Optional[str], latency: float, outcome: Outcome) -> None:
+        """Records a lookup answered, or failed, by the resolver"""
+
+        resolver = resolver or "unknown"
+        failed = outcome in (Outcome.SERVFAIL, Outcome.TIMEOUT)
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.latency.record(latency)
+            if resolver not in self.resolvers:
+                self.resolvers[resolver], self.resolver_failures[resolver] = LatencyHistogram(), 0
+            self.resolvers[resolver].record(latency)
+            self.resolver_failures[resolver] += failed
+            self.rate.add()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "lookups/second": round(self.rate.rate(), 1),
+                "latency": self.latency.status(),
+                "by resolver": {resolver: dict(histogram.status(), failures=self.resolver_failures[resolver])
+                                for resolver, histogram in self.resolvers.items()},
+            }
+
+
+class ResultCache(object):
+    """Stores the targets of the answers in a SQLite database, keyed by domain and queried record types, until their
+    TTL expires: the answers of a run querying other types are not used.
+
+    The answers are kept at least min_ttl seconds, which is also their TTL if the resolver does not provide one.
+    Expired answers are evicted when the cache is opened and closed, together with the ones closest to expire
+    if there are more than max_entries."""
+
+    def __init__(self, path: str, min_ttl: int = 86400, max_entries: int = 50_000_000,
+                 types: Tuple[int, ...] = (DNSMessage.A,)):
+        self.min_ttl, self.max_entries = min_ttl, max_entries
+        self.types = ",".join(map(str, sorted(set(types))))  # the record types queried by the resolver
+        self.hits, self.misses = 0, 0
+        self.pending_writes = 0                 # answers stored since the latest commit
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(answers)")]
+        if columns and "types" not in columns:  # a cache keyed by domain only, whatever the queried types
+            self.connection.execute("DROP TABLE answers")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS answers (domain TEXT, types TEXT, addresses TEXT, "
+                                "expires REAL, PRIMARY KEY (domain, types)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS answers_expires ON answers (expires)")
+        self.evict()
+
+    def get(self, domain: str) -> Optional[Answer]:
+        """Returns the answer for the domain, None if it is not cached or it is expired"""
+
+        with self.lock:
+            row = self.connection.execute("SELECT addresses, expires FROM answers WHERE domain = ? AND types = ?",
+                                          (domain, self.types)).fetchone()
+            now = time.time()
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+            self.hits += 1
+        targets = row[0].split(",") if row[0] else []
+        if targets and not ResultCache.is_address(targets[0]):  # the targets of CNAME records without addresses
+            records = tuple((domain, DNSMessage.CNAME, None, target) for target in targets)
+            return Answer([], int(row[1] - now), records, "cache")
+        return Answer(targets, int(row[1] - now), resolver="cache",
+                      outcome=Outcome.NOERROR if targets else Outcome.NXDOMAIN)
+
+    @staticmethod
+    def is_address(text: str) -> bool:
+        try:
+            ipaddress.ip_address(text)
+            return True
+        except ValueError:
+            return False
+
+    def put(self, domain: str, answer: Answer) -> None:
+        """Stores the answer for the domain, committing every thousand answers"""
+
+        expires = time.time() + max(answer.ttl or 0, self.min_ttl)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                                    (domain, self.types, ",".join(answer.targets), expires))
+            self.pending_writes += 1
+            if self.pending_writes >= 1000:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def evict(self) -> None:
+        """Deletes the expired answers and the ones closest to expire beyond max_entries"""
+
+        with self.lock:
+            self.connection.execute("DELETE FROM answers WHERE expires <= ?", (time.time(),))
+            self.connection.execute("DELETE FROM answers WHERE (domain, types) IN (SELECT domain, types FROM answers "
+                                    "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self) -> None:
+        self.evict()
+        self.connection.close()
+
+    def status(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class Checkpoint(object):
+    """Records the progress of a bruteforce and saves it periodically to a JSON file, so that it can be resumed.
+
+    The words are numbered in the order they are taken from the word source. The words before the watermark are all
+    checked; the pending ones were dispatched but their lookup had not completed, so they are checked again on resume,
+    before the words after the position. The file is replaced atomically: a crash while saving leaves the previous one.
+    """
+
+    def __init__(self, file_name: str, config: dict = None, interval: float = 60.0, position: int = 0,
+                 pending: Dict[int, str] = None, found: Iterable[str] = ()):
+        self.file_name, self.config, self.interval = file_name, config or {}, interval
+        self.position: int = position                           # number of words taken from the word source
+        self.pending: Dict[int, str] = dict(pending or {})      # dispatched words not checked yet, by number
+        self.resumed: Dict[int, str] = dict(self.pending)       # pending words of the loaded checkpoint
+        self.found: Set[str] = set(found)                       # subdomains found before the checkpoint
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.last_save: float = time.monotonic()
+
+    @staticmethod
+    def load(file_name: str, interval: float = 60.0) -> "Checkpoint":
+        """Reads a checkpoint saved by a previous run"""
+
+        with open(file_name, "r") as f:
+            state = json.load(f)
+        pending = {index: word for index, word in state["pending"]}
+        return Checkpoint(file_name, state["config"], interval, state["position"], pending, state["found"])
+
+    @property
+    def watermark(self) -> int:
+        """The number of the first word not checked yet"""
+
+        with self.lock:
+            return min(self.pending, default=self.position)
+
+    def enumerate(self, batches: Iterable[List[str]]) -> Iterable[Tuple[Iterable[int], List[str]]]:
+        """Numbers the batches of words, after the pending words of the resumed checkpoint, and marks them as
+        pending. Returns the numbers and the words of every batch"""
+
+        if self.resumed:
+            indexes = sorted(self.resumed)
+            yield indexes, [self.resumed[index] for index in indexes]
+        for words in batches:
+            with self.lock:
+                indexes = range(self.position, self.position + len(words))
+                self.position += len(words)
+                self.pending.update(zip(indexes, words))
+            yield indexes, words
+
+    def checked(self, index: int) -> None:
+        with self.lock:
+            self.pending.pop(index, None)
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last_save >= self.interval
+
+    def save(self, found: Set[str]) -> None:
+        """Writes the checkpoint to a temporary file, then replaces the checkpoint file with it"""
+
+        with self.lock:
+            state = {"config": self.config, "position": self.position,
+                     "watermark": min(self.pending, default=self.position), "pending": sorted(self.pending.items())}
+        state["found"] = sorted(found)
+
+        with self.save_lock:
+            temporary = self.file_name + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.file_name)
+            self.last_save = time.monotonic()
+
+
+class WildcardDetector(object):
+    """Detects the subdomains resolved by wildcard records.
+
+    Every level between a subdomain and the base domain, e.g. b.example.com and example.com for a.b.example.com,
+    is probed once resolving some random labels under it, and the targets of the answers are cached: their addresses,
+    or their CNAME targets if there is no address.
+    A subdomain whose targets are all among the wildcard targets of one of its levels is a wildcard match.
+    """
+
+    def __init__(self, base_domain: str, probes: int = 2):
+        self.base_domain, self.probes = base_domain, probes
+        self.wildcards: Dict[str, frozenset] = {}       # wildcard targets by level, empty if there is no wildcard
+        self.discarded: int = 0                         # number of subdomains matching a wildcard
+        self.lock = threading.Lock()
+        self.level_locks: Dict[str, object] = {}        # threading or asyncio locks avoiding duplicated probes
+
+    def levels(self, domain: str) -> List[str]:
+        """Returns the parents of the domain up to the base domain"""
+
+        labels = domain[:-len(self.base_domain)].rstrip(".").split(".")
+        return [".".join(labels[i:] + [self.base_domain]) for i in range(1, len(labels))] + [self.base_domain]
+
+    @staticmethod
+    def random_subdomain(level: str) -> str:
+        return "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(16)) + "." + level
+
+    def level_lock(self, level: str, factory: callable):
+        with self.lock:
+            return self.level_locks.setdefault(level, factory())
+
+    def matches(self, level: str, targets: List[str]) -> bool:
+        wildcard = self.wildcards[level]
+        return bool(wildcard) and wildcard.issuperset(targets)
+
+    def discard(self, match: bool) -> bool:
+        if match:
+            with self.lock:
+                self.discarded += 1
+        return match
+
+    def is_wildcard(self, domain: str, targets: List[str], resolver: Resolver) -> bool:
+        """Returns True if the targets of the domain come from a wildcard record, probing its levels if needed"""
+
+        for level in self.levels(domain):
+            with self.level_lock(level, threading.Lock):
+                if level not in self.wildcards:
+                    try:
+                        probed = [resolver.resolve(self.random_subdomain(level)).targets for _ in range(self.probes)]
+                    except ResolveError:  # the level will be probed again by the next subdomain
+                        continue
+                    self.wildcards[level] = frozenset(itertools.chain.from_iterable(probed))
+            if self.matches(level, targets):
+                return self.discard(True)
+        return self.discard(False)
+
+    async def is_wildcard_async(self, domain: str, targets: List[str], resolver: AsyncResolver) -> bool:
+        """Same as is_wildcard, awaiting the asynchronous resolver"""
+
+        for level in self.levels(domain):
+            async with self.level_lock(level, asyncio.Lock):
+                if level not in self.wildcards:
+                    try:
+                        probes = (resolver.resolve(self.random_subdomain(level)) for _ in range(self.probes))
+                        probed = await asyncio.gather(*probes)
+                    except ResolveError:
+                        continue
+                    targets_probed = (answer.targets for answer in probed)
+                    self.wildcards[level] = frozenset(itertools.chain.from_iterable(targets_probed))
+            if self.matches(level, targets):
+                return self.discard(True)
+        return self.discard(False)
+
+
+class EventBus(object):
+    """Delivers the events published by the Model to the subscribed handlers, from a single thread.
+
+    Publishing only enqueues the event, so it never blocks the bruteforce. Handlers are called as
+    handler(event, *args); the events published before the first subscription are delivered to it.
+    """
+
+    FOUND = "found"             # args: the found subdomain and its answer
+    PAUSED = "paused"           # the base domain is not resolving
+    RESUMED = "resumed"         # the base domain is resolving again
+    PROGRESS = "progress"       # args: the number of checked subdomains and the latest one, once per second
+    COMPLETED = "completed"     # args: the set of found subdomains
+
+    def __init__(self):
+        self.events: queue.Queue = queue.Queue()
+        self.handlers: List[callable] = []
+        self.thread: Optional[threading.Thread] = None
+
+    def subscribe(self, handler: callable) -> None:
+        """Adds a handler of all the events, starting the thread delivering them"""
+
+        self.handlers.append(handler)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.dispatch, daemon=True)
+            self.thread.start()
+
+    def publish(self, event: str, *args) -> None:
+        self.events.put((event, args))
+
+    def dispatch(self) -> None:
+        """Calls the handlers for every published event.
+
+        This function is always used as a thread"""
+
+        while True:
+            event, args = self.events.get()
+            try:
+                for handler in self.handlers:
+                    try:
+                        handler(event, *args)
+                    except Exception:  # a faulty handler must not stop the delivery of the next events
+                        logger.exception("Error handling the %s event", event)
+            finally:
+                self.events.task_done()
+
+    def join(self) -> None:
+        """Waits until all the published events are delivered"""
+
+        self.events.join()
 
 
 class Model(object):
@@ -13,19 +1067,56 @@ class Model(object):
 
     Objects of this class can bruteforce subdomains of the base domain"""
 
-    def __init__(self, domain: str, view, words: Iterable[str], thread_limit: int = 100):
+    BATCH_SIZE = 256  # words dispatched at once, checking the due retries and publishing the progress in between
+
+    # empty labels, labels over 63 characters, names over 253 characters and non-ASCII names, one name per line
+    INVALID_DOMAINS = re.compile(r"^\.|\.\.|\.$|[^.\n]{64}|[^\n]{254}|[^\x00-\x7f]", re.MULTILINE)
+
+    # methods of the view handling the events, the other events are handled by the methods with their name
+    VIEW_METHODS = {
+        EventBus.FOUND: "found_subdomain",
+        EventBus.PAUSED: "dns_not_working",
+        EventBus.RESUMED: "dns_working",
+    }
+
+    def __init__(self, domain: str, view, words: Iterable[str], thread_limit: int = 100, resolver=None,
+                 adaptive: bool = False, rate: float = None, burst: float = None, probe_interval: float = 5.0,
+                 filter_wildcards: bool = True, cache: ResultCache = None, checkpoint: Checkpoint = None,
+                 max_attempts: int = 3, retry_delay: float = 0.5, batched: bool = False):
+
+        if thread_limit < 1:
+            raise ValueError("The thread limit must be at least 1")
 
         # set all variables to default values
         self.base_domain, self.view, self.words, self.thread_limit = domain, view, words, thread_limit
-        self.found_subdomains: Set[str] = set()                 # the result set containing all found subdomains
+        self.batched = batched                                  # words is an iterable of lists of words
+        self.resolver = resolver or SystemResolver()            # a Resolver or an AsyncResolver
+        self.limiter = AIMDLimiter(thread_limit) if adaptive else None  # adapts the in-flight queries up to the limit
+        self.bucket = TokenBucket(rate, burst) if rate else None  # limits the queries per second
+        self.probe = HealthProbe(probe_interval)                # decides when to check if the base domain resolves
+        self.wildcards = WildcardDetector(domain) if filter_wildcards else None  # discards the wildcard matches
+        self.cache = cache                                      # answers of previous lookups, possibly of past runs
+        self.checkpoint = checkpoint                            # saves the progress to resume the bruteforce
+        self.max_attempts = max_attempts                        # lookups of a subdomain before giving up
+        self.retries = RetryScheduler(retry_delay)              # failed lookups to make again after a backoff
+        self.metrics = Metrics()                                # outcomes, latencies and rate of the lookups
+        self.retried_count: int = 0                             # number of lookups made again
+        self.failed_count: int = 0                              # number of subdomains given up after max_attempts
+        self.counters_lock = threading.Lock()
+        self.found_subdomains: Set[str] = set(checkpoint.found) if checkpoint else set()  # all found subdomains
         self.checked_subdomains_count: int = 0                  # the number of currently checked seubdomains
         self.latest: Optional[str] = None                       # the latest checked subdomain
-        self.subdomain_threads: Set[threading.Thread] = set()   # currently running threads for bruteforce
+        self.subdomains: queue.Queue = queue.Queue(maxsize=2 * thread_limit)  # bounded queue feeding the workers
+        self.workers: List[threading.Thread] = []               # long-lived threads checking the queued subdomains
+        self.tasks: Dict[asyncio.Task, Tuple[int, str, int]] = {}  # in-flight lookups of the async engine
         self.dns_working, self.dns_not_working = threading.Event(), threading.Event()
         self.complete_bruteforcing = threading.Event()          # event to stop all threads at the end of the script
-        self.dns_not_working.set()
+        self.error: Optional[BaseException] = None              # the exception which stopped the bruteforce, if any
+        self.last_progress: float = time.monotonic()            # monotonic time of the latest progress event
+        self.events = EventBus()                                # notifies the state changes to the subscribers
+        if view:
+            self.events.subscribe(self.notify_view)
 
-        Model.start_daemon_thread(self.dns_checker)  # thread to control if the DNS server resolves the base domain
         self.bruteforce_thread = Model.start_daemon_thread(self.bruteforce)  # thread to make all the subdomain requests
         self.start_time = datetime.datetime.now()
 
@@ -39,99 +1130,520 @@ class Model(object):
         return thread
 
     @staticmethod
-    def domain_exists(domain: str) -> bool:
+    def domain_exists(domain: str, resolver: Resolver = None) -> bool:
         """Check the existence of a domain trying DNS resolution"""
 
         try:
-            socket.gethostbyname(domain)
-            return True
-        except socket.gaierror:  # an exception is thrown if the domain is not resolved
+            return bool((resolver or SystemResolver()).resolve(domain).targets)
+        except ResolveError:
             return False
 
-    def check_domain(self, domain: str) -> None:
-        """If the domain exists add in the found_subdomain set and trigger the view's method"""
+    @staticmethod
+    def is_valid_domain(domain: str) -> bool:
+        """Returns True if the domain can be looked up: no empty label, no label over 63 characters and at most
+        253 characters, once encoded with IDNA"""
 
-        if Model.domain_exists(domain):
-            self.found_subdomains.add(domain)
-            if self.view:
-                self.view.found_subdomain(domain)
+        domain = domain[:-1] if domain.endswith(".") else domain  # the root label
+        if not domain.isascii():
+            try:
+                domain = domain.encode("idna").decode()
+            except UnicodeError:
+                return False
+        return len(domain) <= 253 and all(0 < len(label) <= 63 for label in domain.split("."))
 
-    def thread_limiter(self) -> None:
-        """If the current number of subdomains threads exceeds the limit joins all subdomain threads
+    @staticmethod
+    def all_valid_domains(domains: List[str]) -> bool:
+        """Returns True if is_valid_domain is True for all the domains, checking them at once with a regular
+        expression in the common case of ASCII names"""
+
+        return not Model.INVALID_DOMAINS.search("\n".join(domains)) or all(map(Model.is_valid_domain, domains))
+
+    def notify_view(self, event: str, *args) -> None:
+        """Calls the view's method handling the event, if any"""
+
+        method = getattr(self.view, Model.VIEW_METHODS.get(event, event), None)
+        if method:
+            method(*args)
+
+    def add_found(self, domain: str, answer: Answer = None) -> None:
+        """Add the domain in the found_subdomain set and publish the event"""
+
+        self.found_subdomains.add(domain)
+        self.events.publish(EventBus.FOUND, domain, answer)
+
+    def numbered_batches(self) -> Iterable[Tuple[Iterable[int], List[str]]]:
+        """Returns the batches of at most BATCH_SIZE subdomains to check with the numbers of their words, tracked by
+        the checkpoint if any. The invalid subdomains, e.g. of blank lines of the wordlist, are marked as checked and
+        left out of the batches"""
+
+        if self.batched:
+            batches = (words[i:i + Model.BATCH_SIZE] for words in self.words
+                       for i in range(0, len(words), Model.BATCH_SIZE))
+        else:
+            flat = iter(self.words)
+            batches = iter(lambda: list(itertools.islice(flat, Model.BATCH_SIZE)), [])
+        if self.checkpoint:
+            numbered = self.checkpoint.enumerate(batches)
+        else:
+            counter = itertools.count()
+            numbered = ((list(itertools.islice(counter, len(batch))), batch) for batch in batches)
+
+        suffix = "." + self.base_domain
+        for indexes, words in numbered:
+            subdomains = [(word + suffix).strip(" \n") for word in words]
+            if not Model.all_valid_domains(subdomains):
+                valid = [Model.is_valid_domain(subdomain) for subdomain in subdomains]
+                for index in itertools.compress(indexes, [not v for v in valid]):
+                    self.checked(index)
+                indexes = list(itertools.compress(indexes, valid))
+                subdomains = list(itertools.compress(subdomains, valid))
+            if subdomains:
+                yield indexes, subdomains
+
+    def dispatched(self, subdomains: List[str]) -> None:
+        """Counts the subdomains passed to the resolver, publishing the progress once per second and saving the
+        checkpoint when it is due"""
+
+        self.latest = subdomains[-1]
+        self.checked_subdomains_count += len(subdomains)
+        if time.monotonic() - self.last_progress >= 1.0:
+            self.last_progress = time.monotonic()
+            self.events.publish(EventBus.PROGRESS, self.checked_subdomains_count, self.latest)
+        if self.checkpoint and self.checkpoint.due():
+            self.checkpoint.save(self.found_subdomains)
+
+    def checked(self, index: int) -> None:
+        """Marks the word with the number as checked in the checkpoint"""
+
+        if self.checkpoint:
+            self.checkpoint.checked(index)
+
+    @property
+    def concurrency(self) -> int:
+        """The number of queries allowed in flight"""
+
+        return self.limiter.limit if self.limiter else self.thread_limit
+
+    @property
+    def in_flight(self) -> int:
+        """The number of lookups in progress"""
+
+        if isinstance(self.resolver, AsyncResolver):
+            return len(self.tasks)
+        return max(0, self.subdomains.unfinished_tasks - self.subdomains.qsize())
+
+    def lookup(self, domain: str) -> Optional[Answer]:
+        """Resolves the domain, feeding the limiter, the health probe and the metrics. Returns None if the lookup
+        failed, else the answer with its latency"""
+
+        if self.limiter:
+            self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            answer = self.resolver.resolve(domain)
+        except ResolveError as e:
+            answer, error = None, e
+        finally:
+            if self.limiter:
+                self.limiter.release()
+
+        latency = time.monotonic() - start
+        if answer is not None:
+            self.metrics.record(answer.resolver, latency, answer.outcome)
+        else:
+            self.metrics.record(error.resolver, latency, error.outcome)
+        self.probe.record(answer is not None)
+        if self.limiter:
+            self.limiter.record(answer is not None, latency)
+        return answer._replace(latency=latency) if answer is not None else None
+
+    async def lookup_async(self, domain: str) -> Optional[Answer]:
+        """Same as lookup, awaiting the asynchronous resolver"""
+
+        start = time.monotonic()
+        try:
+            answer = await self.resolver.resolve(domain)
+        except ResolveError as e:
+            answer, error = None, e
+
+        latency = time.monotonic() - start
+        if answer is not None:
+            self.metrics.record(answer.resolver, latency, answer.outcome)
+        else:
+            self.metrics.record(error.resolver, latency, error.outcome)
+        self.probe.record(answer is not None)
+        if self.limiter:
+            self.limiter.record(answer is not None, latency)
+        return answer._replace(latency=latency) if answer is not None else None
+
+    def check_domain(self, domain: str) -> bool:
+        """If the domain exists add in the found_subdomain set and publish the event.
+
+        The answer is taken from the cache if possible, else it is looked up and stored in the cache.
+        Returns False if the lookup failed, so the domain is not checked yet"""
+
+        answer = self.cache.get(domain) if self.cache else None
+        if answer is None:
+            answer = self.lookup(domain)
+            if answer is None:
+                return False
+            if self.cache:
+                self.cache.put(domain, answer)
+
+        if not answer.targets:
+            return True
+        if self.wildcards and self.wildcards.is_wildcard(domain, answer.targets, self.resolver):
+            return True
+        self.add_found(domain, answer)
+        return True
 
-        This function is used to avoid memory leaks making the program wait until all the threads are closed.
-        """
+    async def check_domain_async(self, domain: str) -> bool:
+        """Same as check_domain, awaiting the asynchronous resolver"""
+
+        answer = self.cache.get(domain) if self.cache else None
+        if answer is None:
+            answer = await self.lookup_async(domain)
+            if answer is None:
+                return False
+            if self.cache:
+                self.cache.put(domain, answer)
+
+        if not answer.targets:
+            return True
+        if self.wildcards and await self.wildcards.is_wildcard_async(domain, answer.targets, self.resolver):
+            return True
+        self.add_found(domain, answer)
+        return True
+
+    def failed(self, index: int, subdomain: str, attempt: int) -> None:
+        """Schedules another lookup of a subdomain whose lookup failed, or gives it up after max_attempts"""
+
+        if attempt < self.max_attempts:
+            self.retries.schedule(index, subdomain, attempt + 1)
+            return
+        self.give_up(index)
+
+    def give_up(self, index: int) -> None:
+        """Counts a subdomain given up, marking its word as checked"""
 
-        while len(self.subdomain_threads) > self.thread_limit:
-            thread = self.subdomain_threads.pop()
-            thread.join()
+        with self.counters_lock:
+            self.failed_count += 1
+        self.checked(index)
 
-    def dns_checker(self) -> None:
-        """Check if DNS resolve the base domain.
+    def due_retries(self) -> Iterable[Tuple[int, str, int]]:
+        """Takes the retries whose backoff elapsed, counting them"""
 
-        This function is used to check if DNS server is still responding.
+        for retry in self.retries.due():
+            with self.counters_lock:
+                self.retried_count += 1
+            yield retry
+
+    def worker(self) -> None:
+        """Checks the subdomains taken from the queue until a None sentinel is received
+
+        This function is always used as a thread of the worker pool"""
+
+        while True:
+            item = self.subdomains.get()
+            try:
+                if item is None:  # sentinel: no more subdomains to check
+                    return
+                index, subdomain, attempt = item
+                try:
+                    checked = self.check_domain(subdomain)
+                except Exception:  # the worker must survive to check the next subdomains
+                    logger.exception("Unexpected error checking %s, giving it up", subdomain)
+                    self.give_up(index)
+                    continue
+                if checked:
+                    self.checked(index)
+                else:
+                    self.failed(index, subdomain, attempt)
+            finally:
+                self.subdomains.task_done()
+
+    def set_dns_working(self, working: bool) -> None:
+        """Records the outcome of a probe, sets the events of the DNS status and publishes its changes"""
+
+        self.probe.probed(working)
+        if working:
+            if self.dns_not_working.is_set():
+                self.events.publish(EventBus.RESUMED)
+            self.dns_working.set()
+            self.dns_not_working.clear()
+        else:
+            if not self.dns_not_working.is_set():
+                self.events.publish(EventBus.PAUSED)
+            self.dns_working.clear()
+            self.dns_not_working.set()
+
+    def check_dns(self) -> None:
+        """Check if DNS answers for the base domain, when the error rate of the lookups is high.
+
+        This function is used to check if DNS server is still responding, pausing the bruteforce until it does.
         Some DNS servers ban users who make a large number of requests per second.
         """
 
-        while not self.complete_bruteforcing.is_set():
-            if Model.domain_exists(self.base_domain):
-                self.dns_working.set()
-                self.dns_not_working.clear()
-            else:
-                self.dns_working.clear()
-                self.dns_not_working.set()
+        while self.probe.due():
+            try:  # any definitive answer proves the resolver works, even if the base domain has no address
+                self.resolver.resolve(self.base_domain)
+                self.set_dns_working(True)
+            except ResolveError:
+                self.set_dns_working(False)
+            if self.dns_working.is_set():
+                return
+            time.sleep(self.probe.interval)
 
-        time.sleep(0.1)
+    async def check_dns_async(self) -> None:
+        """Same as check_dns, awaiting the asynchronous resolver"""
+
+        while self.probe.due():
+            try:
+                await self.resolver.resolve(self.base_domain)
+                self.set_dns_working(True)
+            except ResolveError:
+                self.set_dns_working(False)
+            if self.dns_working.is_set():
+                return
+            await asyncio.sleep(self.probe.interval)
 
     def bruteforce(self) -> None:
-        """Creates a thread to check every subdomain"""
+        """Checks every subdomain with the resolver, then notifies the completion.
 
-        for word in self.words:
+        The completion is also notified if the bruteforce fails, e.g. if the word source cannot be read: the error
+        is logged and kept in the error attribute, and the checkpoint is saved so that the bruteforce can be resumed"""
 
-            # pause if base domain is not resolving
-            self.dns_working.wait()
+        try:
+            if isinstance(self.resolver, AsyncResolver):
+                asyncio.run(self.bruteforce_async())
+            else:
+                self.resolver.open()
+                try:
+                    self.bruteforce_threads()
+                finally:
+                    self.resolver.close()
+        except Exception as e:
+            self.error = e
+            logger.error("The bruteforce failed", exc_info=e)
+        finally:
+            if self.cache:
+                self.cache.close()
+            if self.checkpoint:
+                self.checkpoint.save(self.found_subdomains)
+            self.events.publish(EventBus.COMPLETED, self.found_subdomains)
+            self.complete_bruteforcing.set()
+
+    def enqueue(self, index: int, subdomain: str, attempt: int) -> None:
+        """Enqueues a lookup for the workers, once the base domain resolves and a token is available"""
+
+        # pause if base domain is not resolving
+        self.check_dns()
+
+        if self.bucket:
+            self.bucket.acquire()
+
+        # enqueue the subdomain, waiting for a free slot if the queue is full
+        self.subdomains.put((index, subdomain, attempt))
+
+    def bruteforce_threads(self) -> None:
+        """Feeds every subdomain to a fixed pool of thread_limit workers
+
+        The queue is bounded, so this loop blocks while all workers are busy instead of spawning new threads.
+        The failed lookups whose backoff elapsed are enqueued before the next batch of subdomains, and after the last
+        one until none is left.
+        """
 
-            subdomain = f"{word}.{self.base_domain}".strip(" \n")
+        self.workers = [Model.start_daemon_thread(self.worker) for _ in range(self.thread_limit)]
 
-            # create and start a thread to check if subdomain exists
-            self.subdomain_threads.add(Model.start_daemon_thread(target=self.check_domain, args=(subdomain,)))
-            self.thread_limiter()
+        for indexes, subdomains in self.numbered_batches():
+            for retry in self.due_retries():
+                self.enqueue(*retry)
 
-            self.latest = subdomain
-            self.checked_subdomains_count += 1
+            for index, subdomain in zip(indexes, subdomains):
+                self.enqueue(index, subdomain, 1)
+            self.dispatched(subdomains)
 
-        # when all subdomains are checked, wait for all threads to close
-        for thread in self.subdomain_threads:
-            thread.join()
+        # when all subdomains are checked, retry the failed lookups until they succeed or run out of attempts
+        self.subdomains.join()
+        while self.retries:
+            time.sleep(self.retries.delay())
+            for retry in self.due_retries():
+                self.enqueue(*retry)
+            self.subdomains.join()
 
-        self.complete_bruteforcing.set()
-        if self.view:
-            self.view.completed(self.found_subdomains)
+        # stop the workers and wait for them to close
+        for _ in self.workers:
+            self.subdomains.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    async def bruteforce_async(self) -> None:
+        """Checks every subdomain from a single asyncio loop, keeping at most concurrency queries in flight"""
+
+        await self.resolver.open()
+        try:
+            slot_freed = asyncio.Event()
+            tasks = self.tasks  # in-flight lookups with their index and attempt
+
+            def task_done(task: asyncio.Task) -> None:
+                index, subdomain, attempt = tasks.pop(task)
+                if not task.cancelled():
+                    if task.exception() is not None:  # the word must not stay pending in the checkpoint
+                        logger.error("Unexpected error checking %s, giving it up", subdomain,
+                                     exc_info=task.exception())
+                        self.give_up(index)
+                    elif task.result():
+                        self.checked(index)
+                    else:
+                        self.failed(index, subdomain, attempt)
+                slot_freed.set()
+
+            async def launch(index: int, subdomain: str, attempt: int) -> None:
+                # pause if base domain is not resolving, without blocking the event loop
+                await self.check_dns_async()
+
+                if self.bucket:
+                    delay = self.bucket.reserve()
+                    if delay:
+                        await asyncio.sleep(delay)
+
+                while len(tasks) >= self.concurrency:
+                    slot_freed.clear()
+                    await slot_freed.wait()
+
+                task = asyncio.ensure_future(self.check_domain_async(subdomain))
+                task.add_done_callback(task_done)
+                tasks[task] = (index, subdomain, attempt)
+
+            for indexes, subdomains in self.numbered_batches():
+                for retry in self.due_retries():
+                    await launch(*retry)
+
+                for index, subdomain in zip(indexes, subdomains):
+                    await launch(index, subdomain, 1)
+                self.dispatched(subdomains)
+
+            # wait for the in-flight queries, retrying the failed ones until none is left
+            while tasks or self.retries:
+                for retry in self.due_retries():
+                    await launch(*retry)
+                if tasks:
+                    await asyncio.wait(list(tasks), timeout=self.retries.delay() if self.retries else None,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                elif self.retries:
+                    await asyncio.sleep(self.retries.delay())
+        finally:
+            self.resolver.close()
+
+
+class WordlistIndex(object):
+    """A sidecar SQLite index of a wordlist, built once and rebuilt if the wordlist changes.
+
+    It stores the byte offset of one line every step lines, and the line and the byte offset of the first occurrence
+    of every word, keyed by a 64-bit hash, so a wordlist can be resumed from a line or from a word seeking straight
+    to it whatever its size.
+
+    The index is built in a temporary file, then moved into place, so the processes of a sharded bruteforce can
+    build it at the same time: the last one replaces the others, and a process never reads an incomplete index."""
+
+    def __init__(self, file_name: str, step: int = 1024):
+        self.file_name, self.step = file_name, step
+        self.index_name = file_name + ".idx"
+        self.connection: Optional[sqlite3.Connection] = None
+        if os.path.exists(self.index_name):
+            self.connection = sqlite3.connect(self.index_name)
+            try:
+                signature = dict(self.connection.execute("SELECT key, value FROM meta"))
+            except sqlite3.DatabaseError:  # not an index of this version
+                signature = None
+            if signature != self.file_signature():
+                self.connection.close()
+                self.connection = None
+        if self.connection is None:
+            self.build()
+            self.connection = sqlite3.connect(self.index_name)
+
+    def file_signature(self) -> dict:
+        stat = os.stat(self.file_name)
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "step": self.step}
+
+    @staticmethod
+    def word_hash(word: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(word, digest_size=8).digest(), "big", signed=True)
+
+    def build(self) -> None:
+        """Reads the whole wordlist and stores its offsets in a temporary file, then replaces the index with it"""
+
+        def offsets():  # (line index, byte offset, word) of every line
+            with open(self.file_name, "rb") as f:
+                offset = 0
+                for line_index, line in enumerate(f):
+                    yield line_index, offset, line.strip(b" \r\n")
+                    offset += len(line)
+
+        temporary = f"{self.index_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        connection = sqlite3.connect(temporary)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)")
+                connection.execute("CREATE TABLE lines (line INTEGER PRIMARY KEY, offset INTEGER)")
+                connection.execute("CREATE TABLE words (hash INTEGER PRIMARY KEY, line INTEGER, offset INTEGER) "
+                                   "WITHOUT ROWID")
+                for rows in iter(lambda rows=offsets(): list(itertools.islice(rows, 100_000)), []):
+                    connection.executemany("INSERT INTO lines VALUES (?, ?)",
+                                           ((line, offset) for line, offset, _ in rows if line % self.step == 0))
+                    connection.executemany("INSERT OR IGNORE INTO words VALUES (?, ?, ?)",
+                                           ((self.word_hash(word), line, offset) for line, offset, word in rows))
+                connection.executemany("INSERT INTO meta VALUES (?, ?)", self.file_signature().items())
+            connection.close()
+            os.replace(temporary, self.index_name)
+        finally:
+            connection.close()
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def line_offset(self, line: int) -> Tuple[int, int]:
+        """Returns the index and the byte offset of the closest indexed line before the line"""
+
+        row = self.connection.execute("SELECT line, offset FROM lines WHERE line <= ? ORDER BY line DESC LIMIT 1",
+                                      (line,)).fetchone()
+        return row or (0, 0)
+
+    def word_offset(self, word: str) -> Optional[Tuple[int, int]]:
+        """Returns the line index and the byte offset of the first occurrence of the word, None if it is missing"""
+
+        return self.connection.execute("SELECT line, offset FROM words WHERE hash = ?",
+                                       (self.word_hash(word.encode()),)).fetchone()
+
+    def close(self) -> None:
+        self.connection.close()
 
 
 class Controller(object):
     """This class controls the model and contains some useful methods to get iterables of strings"""
 
-    def __init__(self, domain: str, view, words: Iterable[str], thread_limit=100):
+    ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"  # the first bytes of a zstd frame
+
+    def __init__(self, domain: str, view, words: Iterable[str], thread_limit=100, resolver=None, adaptive=False,
+                 rate=None, burst=None, probe_interval=5.0, filter_wildcards=True, cache=None, checkpoint=None,
+                 max_attempts=3, retry_delay=0.5, metrics_port=None, batched=False):
         """Checks the arguments and executes the model"""
 
         if domain is None:
             raise TypeError("Base domain is not set")
 
         # create a Model object which will start bruteforce in a new thread
-        self.model = Model(domain, view, words, thread_limit=thread_limit)
+        self.model = Model(domain, view, words, thread_limit=thread_limit, resolver=resolver, adaptive=adaptive,
+                           rate=rate, burst=burst, probe_interval=probe_interval, filter_wildcards=filter_wildcards,
+                           cache=cache, checkpoint=checkpoint, max_attempts=max_attempts, retry_delay=retry_delay,
+                           batched=batched)
+
+        # serve the metrics over HTTP until the program exits
+        self.metrics_server = MetricsServer(self.model, metrics_port).start() if metrics_port is not None else None
 
         self.view: ConsoleView = view
         if self.view:
 
-            # start view's threads to check model's update
-            event_listener_threads = [
-                (self.model.dns_working, lambda: self.view.dns_working()),
-                (self.model.dns_not_working, lambda: self.view.dns_not_working()),
-            ]
-            for args in event_listener_threads:
-                Model.start_daemon_thread(target=self.event_listener, args=args)
-
             # print start message
             self.view.start()
 
@@ -140,10 +1652,20 @@ class Controller(object):
                 try:
                     input()
                     self.view.print_status(self.current_status())
+                except EOFError:  # no terminal, e.g. in a container: the status is served by the metrics server
+                    self.model.complete_bruteforcing.wait()
                 except KeyboardInterrupt:  # raised when the user forces program interruption
                     self.view.print_status(self.current_status())
+                    if self.model.checkpoint:
+                        self.model.checkpoint.save(self.model.found_subdomains)
+                    self.view.close()
                     exit(1)
 
+            # wait for the view to handle the remaining events
+            self.model.events.join()
+            if self.model.error is not None:
+                exit(1)
+
     def current_status(self) -> dict:
         """Returns a dictionary with some useful data from the Model object"""
 
@@ -152,72 +1674,532 @@ class Controller(object):
             "latest subdomain": self.model.latest,                          # latest checked subdomain
             "count": self.model.checked_subdomains_count,                   # number of checked subdomains
             "subdomains/second": round(self.model.checked_subdomains_count / (datetime.datetime.now() - self.model.start_time).total_seconds()),
-            "subdomain threads": len(self.model.subdomain_threads)          # currently running threads for bruteforce
+            "workers": sum(worker.is_alive() for worker in self.model.workers),  # running threads of the pool
+            "queue size": self.model.subdomains.qsize(),                    # subdomains waiting for a worker
+            "window": self.model.concurrency,                               # queries currently allowed in flight
+            "wildcard matches": self.model.wildcards.discarded if self.model.wildcards else None,  # discarded
+            "resolvers": self.model.resolver.status(),                      # statistics of the resolvers
+            "cache": self.model.cache.status() if self.model.cache else None,   # hits and misses of the cache
+            "watermark": self.model.checkpoint.watermark if self.model.checkpoint else None,  # words all checked
+            "outcomes": {outcome.value: count for outcome, count in self.model.metrics.outcomes.items()},
+            "retries": self.model.retried_count,                            # failed lookups made again
+            "retry queue": len(self.model.retries),                         # failed lookups waiting for a retry
+            "failed": self.model.failed_count,                              # subdomains given up
+            "in flight": self.model.in_flight,                              # lookups in progress
+            **self.model.metrics.status(),                                  # rate and latencies of the lookups
         }
 
-    def event_listener(self, event: threading.Event, action: callable) -> None:
-        """Waits for the event and then executes the action.
-
-        This function is always used as a thread"""
+    @staticmethod
+    def get_resolvers_from_file(file_name: str) -> List[Tuple[str, int]]:
+        """Reads the file and returns the addresses of the nameservers, one per line, skipping comments"""
 
-        completed = self.model.complete_bruteforcing  # the completed event
-        while not completed.is_set():  # repeat until the bruteforce is complete
+        with open(file_name, "r") as f:
+            lines = (line.split("#")[0].strip() for line in f)
+            return [Nameserver.parse_address(line) for line in lines if line]
 
-            while event.is_set():  # if event is already set, wait for clear
-                time.sleep(0.1)
+    @staticmethod
+    def parse_shard(text: str) -> Tuple[int, int]:
+        """Parses a shard in the K/N format, the K-th of N shards counting from 0"""
 
-            event.wait(1)
-            if event.is_set():
-                action()
+        try:
+            shard, count = (int(part) for part in text.split("/"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid shard {text!r}, expected K/N") from None
+        if not 0 <= shard < count:
+            raise argparse.ArgumentTypeError(f"invalid shard {text!r}, K must be between 0 and N - 1")
+        return shard, count
 
     @staticmethod
-    def get_words_from_file(file_name: str, start_from: str = None) -> str:
-        """Reads the file and return all words as a generator"""
+    def parse_types(text: str) -> Tuple[int, ...]:
+        """Parses a comma-separated list of record types among A, AAAA and CNAME"""
 
-        with open(file_name, "r") as f:
-            found = False
+        types = {name: record_type for record_type, name in DNSMessage.TYPE_NAMES.items() if name != "SOA"}
+        try:
+            return tuple(dict.fromkeys(types[name.strip().upper()] for name in text.split(",")))
+        except KeyError as e:
+            raise argparse.ArgumentTypeError(f"invalid record type {e.args[0]!r}, expected A, AAAA or CNAME") from None
 
-            for line in f:
-                word = line.strip(" \n")
+    @staticmethod
+    def shard_range(total: int, shard: Tuple[int, int]) -> Tuple[int, int]:
+        """Returns the start and stop indexes of the shard, splitting total words in contiguous ranges"""
+
+        return total * shard[0] // shard[1], total * (shard[0] + 1) // shard[1]
 
-                if word == start_from:  # found the start_from words
-                    found = True
+    @staticmethod
+    def get_words_from_file(file_name: str, start_from: str = None, start: int = 0,
+                            shard: Tuple[int, int] = None, use_index: bool = False, skip: int = 0) -> Iterable[str]:
+        """Reads the file and return all words as a generator.
+
+        The words before start_from, or before the line at the start index, are skipped.
+        With a shard (K, N), only the words of the lines whose index modulo N is K are returned.
+        The first skip words which would be returned are skipped too, e.g. the words taken by a resumed bruteforce.
+        With use_index, the skipped words are not read: the file is seeked using its sidecar index.
+        Compressed files are not indexed, their skipped words are always read.
+        """
 
-                if start_from is None or found:  # yield word if start_from is not set or if it's already found
-                    yield word
+        return itertools.chain.from_iterable(
+            Controller.get_word_batches_from_file(file_name, start_from, start, shard, use_index, skip=skip))
 
     @staticmethod
-    def generate_word(letter_count: int, start_from: str = "", alphabet: str = string.ascii_lowercase):
-        """Generates all words with the provided number of letters"""
+    def get_word_batches_from_file(file_name: str, start_from: str = None, start: int = 0,
+                                   shard: Tuple[int, int] = None, use_index: bool = False,
+                                   chunk_size: int = 1 << 20, skip: int = 0) -> Iterable[List[str]]:
+        """Same as get_words_from_file, returning the words in batches.
+
+        The file is memory-mapped and split in chunks of about chunk_size bytes ending at a line end.
+        Each chunk is decoded and split in lines at once, so there is no work in Python for every line.
+        Compressed files are decompressed while they are read instead, see get_word_batches_from_stream.
+        """
 
-        letters: List[List[str]] = []  # a list of lists of chars
+        stream = Controller.open_compressed(file_name)
+        if stream is not None:
+            with stream:
+                batches = Controller.get_word_batches_from_stream(stream, start_from, start, shard, chunk_size)
+                yield from Controller.skip_words(batches, skip)
+            return
 
-        for i in range(letter_count):
+        first_line, offset = 0, 0  # index and byte offset of the line where the reading starts
+        wordlist_index = None
+        if use_index and (start or start_from is not None or skip):
             try:
-                first = start_from[i]  # the first letter
-                all_chars = alphabet[alphabet.index(first):]  # all chars after the first (included)
-                letters.append(list(all_chars))
-            except IndexError:
-                letters.append(list(alphabet))
+                wordlist_index = WordlistIndex(file_name)
+                first_line, offset = wordlist_index.line_offset(start)
+                word_offset = wordlist_index.word_offset(start_from) if start_from is not None else None
+                if word_offset is not None and word_offset[0] >= start:
+                    first_line, offset = word_offset
+            except (sqlite3.Error, OSError) as e:  # e.g. a read-only directory: the lines are scanned instead
+                logger.warning("Cannot use the index of %s, scanning it: %s", file_name, e)
+                first_line, offset, wordlist_index = 0, 0, None
+
+        with open(file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:  # empty files cannot be mapped
+                if wordlist_index is not None:
+                    wordlist_index.close()
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                try:
+                    line = max(start, first_line)
+                    offset = Controller.skip_lines(data, offset, start - first_line, chunk_size)
+
+                    if start_from is not None:
+                        found = Controller.find_line(data, offset, start_from)
+                        if found is None:
+                            return
+                        line += Controller.count_lines(data, offset, found, chunk_size)
+                        offset = found
+
+                    if skip:  # the line after the skip-th returned word
+                        step = shard[1] if shard else 1
+                        target = line + ((shard[0] - line) % step if shard else 0) + skip * step
+                        if wordlist_index is not None:
+                            indexed_line, indexed_offset = wordlist_index.line_offset(target)
+                            if indexed_line > line:
+                                line, offset = indexed_line, indexed_offset
+                        offset = Controller.skip_lines(data, offset, target - line, chunk_size)
+                        line = target
+                finally:
+                    if wordlist_index is not None:
+                        wordlist_index.close()
+
+                while offset < len(data):
+                    end = data.find(b"\n", offset + chunk_size)
+                    end = len(data) if end == -1 else end + 1
+                    words = Controller.split_words(data[offset:end])
+                    yield words if shard is None else words[(shard[0] - line) % shard[1]::shard[1]]
+                    line += len(words)
+                    offset = end
 
-        return ("".join(comb) for comb in itertools.product(*letters))
+    @staticmethod
+    def skip_words(batches: Iterable[List[str]], count: int) -> Iterable[List[str]]:
+        """Returns the batches without their first count words"""
+
+        for words in batches:
+            if count >= len(words):
+                count -= len(words)
+                continue
+            yield words[count:] if count else words
+            count = 0
+
+    @staticmethod
+    def is_zstd(file_name: str) -> bool:
+        """Returns True if the file is compressed with zstd, which requires the zstandard package"""
+
+        with open(file_name, "rb") as f:
+            return f.read(len(Controller.ZSTD_MAGIC)) == Controller.ZSTD_MAGIC
+
+    @staticmethod
+    def open_compressed(file_name: str) -> Optional[BinaryIO]:
+        """Opens a gzip, bzip2, xz or zstd file as a stream of decompressed bytes, detecting the format by its magic
+        bytes. Returns None if the file is not compressed."""
+
+        with open(file_name, "rb") as f:
+            magic = f.read(6)
+
+        if magic.startswith(b"\x1f\x8b"):
+            return gzip.open(file_name, "rb")
+        if magic.startswith(b"BZh"):
+            return bz2.open(file_name, "rb")
+        if magic.startswith(b"\xfd7zXZ\x00"):
+            return lzma.open(file_name, "rb")
+        if magic.startswith(Controller.ZSTD_MAGIC):
+            if zstandard is None:
+                raise ImportError(f"the zstandard package is required to read {file_name}")
+            return zstandard.ZstdDecompressor().stream_reader(open(file_name, "rb"), closefd=True)
+        return None
+
+    @staticmethod
+    def get_word_batches_from_stream(stream: BinaryIO, start_from: str = None, start: int = 0,
+                                     shard: Tuple[int, int] = None, chunk_size: int = 1 << 20) -> Iterable[List[str]]:
+        """Same as get_word_batches_from_file, reading the lines from a stream of bytes.
+
+        The stream is read chunk_size bytes at a time, so the memory used does not depend on its size.
+        It cannot be seeked: the words before start or start_from are read and skipped.
+        """
+
+        def chunks():  # chunks of the stream ending at a line end
+            rest = b""
+            for data in iter(lambda: stream.read(chunk_size), b""):
+                data = rest + data
+                end = data.rfind(b"\n") + 1
+                rest = data[end:]
+                if end:
+                    yield data[:end]
+            if rest:
+                yield rest
+
+        line, found = 0, start_from is None  # index of the first line of the chunk, start_from reached
+        for chunk in chunks():
+            words = Controller.split_words(chunk)
+            first = min(max(start - line, 0), len(words))  # first word of the chunk to return
+            if not found:
+                try:
+                    first, found = words.index(start_from, first), True
+                except ValueError:
+                    line += len(words)
+                    continue
+
+            line += first
+            words = words[first:]
+            if words:
+                yield words if shard is None else words[(shard[0] - line) % shard[1]::shard[1]]
+            line += len(words)
+
+    @staticmethod
+    def split_words(chunk: bytes) -> List[str]:
+        """Decodes the lines in the chunk and returns them stripped of spaces, like a file opened in text mode"""
+
+        text = chunk.decode("utf-8", "replace")
+        if "\r" in text:  # universal newlines
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        words = text.split("\n")
+        if text.endswith("\n"):
+            words.pop()
+        if " " in text:
+            words = [word.strip(" ") for word in words]
+        return words
+
+    @staticmethod
+    def skip_lines(data: mmap.mmap, offset: int, count: int, chunk_size: int) -> int:
+        """Returns the offset of the line count lines after the one at offset"""
+
+        while count > 0 and offset < len(data):
+            chunk = data[offset:offset + chunk_size]
+            newlines = chunk.count(b"\n")
+            if newlines >= count:
+                return offset + len(chunk) - len(chunk.split(b"\n", count)[-1])
+            count -= newlines
+            offset += len(chunk)
+        return min(offset, len(data))
+
+    @staticmethod
+    def count_lines(data: mmap.mmap, start: int, end: int, chunk_size: int) -> int:
+        """Returns the number of line ends between the offsets"""
+
+        return sum(data[offset:min(offset + chunk_size, end)].count(b"\n") for offset in range(start, end, chunk_size))
+
+    @staticmethod
+    def find_line(data: mmap.mmap, offset: int, word: str) -> Optional[int]:
+        """Returns the offset of the first line after offset whose stripped content is the word, None if missing"""
+
+        target = word.encode()
+        position = data.find(target, offset)
+        while position != -1:
+            line_start = data.rfind(b"\n", offset, position) + 1 or offset
+            line_end = data.find(b"\n", position)
+            if data[line_start:len(data) if line_end == -1 else line_end].strip(b" \r") == target:
+                return line_start
+            position = data.find(target, position + 1)
+        return None
+
+    @staticmethod
+    def word_index(word: str, alphabet: str = string.ascii_lowercase) -> int:
+        """Returns the position of the word among all the words with its number of letters (mixed-radix rank)"""
+
+        index = 0
+        for char in word:
+            index = index * len(alphabet) + alphabet.index(char)
+        return index
+
+    @staticmethod
+    def index_word(index: int, letter_count: int, alphabet: str = string.ascii_lowercase) -> str:
+        """Returns the word at the position among all the words with letter_count letters (mixed-radix unrank)"""
+
+        chars: List[str] = []
+        for _ in range(letter_count):
+            index, digit = divmod(index, len(alphabet))
+            chars.append(alphabet[digit])
+        return "".join(reversed(chars))
+
+    @staticmethod
+    def generate_word(letter_count: int, start_from: str = "", alphabet: str = string.ascii_lowercase,
+                      start: int = None, stop: int = None, shard: Tuple[int, int] = None,
+                      skip: int = 0) -> Iterable[str]:
+        """Generates all words with the provided number of letters, in alphabetical order.
+
+        The generation starts from the start_from word, completed with the first letter of the alphabet if it is
+        shorter, or from the word at the start index, and it stops before the word at the stop index.
+        With a shard (K, N), only the words of the K-th of N contiguous ranges of indexes are generated.
+        The first skip words are not generated, e.g. the ones already checked by a resumed bruteforce.
+        """
+
+        total = len(alphabet) ** letter_count
+        if start is None:
+            start = Controller.word_index(start_from[:letter_count].ljust(letter_count, alphabet[0]), alphabet) \
+                if start_from else 0
+        stop = total if stop is None else min(stop, total)
+        if shard is not None:
+            shard_start, shard_stop = Controller.shard_range(total, shard)
+            start, stop = max(start, shard_start), min(stop, shard_stop)
+        start += skip
+        if start >= stop:
+            return iter(())
+
+        # the words after the first one are all the words with its prefix up to the position i, followed by a greater
+        # letter at the position i and by any letter at the next positions, for every position from the last one
+        def group(prefix: str, letters: str, repeat: int) -> Iterable[str]:
+            return (prefix + letter + "".join(comb) for letter in letters
+                    for comb in itertools.product(alphabet, repeat=repeat))
+
+        first = Controller.index_word(start, letter_count, alphabet)
+        groups = (group(first[:i], alphabet[alphabet.index(first[i]) + (i < letter_count - 1):], letter_count - 1 - i)
+                  for i in reversed(range(letter_count)))
+
+        return itertools.islice(itertools.chain.from_iterable(groups), stop - start)
+
+
+class MetricsServer(object):
+    """Serves the metrics of the Model over HTTP in the Prometheus text format, so a bruteforce running without a
+    terminal can be scraped into dashboards.
+
+    The server answers one request at a time from a daemon thread; every scrape copies the lookup metrics under
+    their lock and formats them while the bruteforce goes on."""
+
+    PREFIX = "subdomain_bruteforce_"
+
+    def __init__(self, model: "Model", port: int, host: str = ""):
+        self.model = model
+        self.httpd = http.server.HTTPServer((host, port), MetricsHandler)
+        self.httpd.metrics_server = self
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """The address of the server, with the port chosen by the system if port was 0"""
+
+        return self.httpd.server_address[:2]
+
+    def start(self) -> "MetricsServer":
+        self.thread = Model.start_daemon_thread(self.httpd.serve_forever)
+        return self
+
+    def close(self) -> None:
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+
+    @staticmethod
+    def format_sample(name: str, value, labels: Dict[str, str] = None) -> str:
+        if labels:
+            escaped = (str(label).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+                       for label in labels.values())
+            name += "{" + ",".join(f'{key}="{label}"' for key, label in zip(labels, escaped)) + "}"
+        if isinstance(value, float):
+            value = "+Inf" if value == float("inf") else repr(value)
+        return f"{MetricsServer.PREFIX}{name} {value}"
+
+    def exposition(self) -> str:
+        """Returns the metrics in the Prometheus text format (version 0.0.4)"""
+
+        model, metrics = self.model, self.model.metrics
+        with metrics.lock:
+            outcomes = dict(metrics.outcomes)
+            counts, count, total = list(metrics.latency.counts), metrics.latency.count, metrics.latency.sum
+            resolvers = {resolver: ([histogram.quantile(q) for q in (0.5, 0.9, 0.99)], histogram.count,
+                                    histogram.sum, metrics.resolver_failures[resolver])
+                         for resolver, histogram in metrics.resolvers.items()}
+            rate = metrics.rate.rate()
+
+        lines = []
+
+        def family(name: str, kind: str, description: str, samples: Iterable[tuple]) -> None:
+            lines.append(f"# HELP {MetricsServer.PREFIX}{name} {description}")
+            lines.append(f"# TYPE {MetricsServer.PREFIX}{name} {kind}")
+            lines.extend(MetricsServer.format_sample(*sample) for sample in samples)
+
+        family("checked_total", "counter", "Subdomains taken from the word source",
+               [("checked_total", model.checked_subdomains_count)])
+        family("found", "gauge", "Subdomains found", [("found", len(model.found_subdomains))])
+        family("lookups_total", "counter", "Lookups by outcome",
+               [("lookups_total", number, {"outcome": outcome.value}) for outcome, number in outcomes.items()])
+        family("retries_total", "counter", "Failed lookups made again", [("retries_total", model.retried_count)])
+        family("failed_total", "counter", "Subdomains given up after max attempts",
+               [("failed_total", model.failed_count)])
+        family("lookups_per_second", "gauge", "Lookups per second over the latest 10 seconds",
+               [("lookups_per_second", rate)])
+        family("in_flight", "gauge", "Lookups in progress", [("in_flight", model.in_flight)])
+        family("queue_size", "gauge", "Subdomains waiting for a worker", [("queue_size", model.subdomains.qsize())])
+        family("retry_queue", "gauge", "Failed lookups waiting for their retry", [("retry_queue", len(model.retries))])
+        family("window", "gauge", "Queries allowed in flight", [("window", model.concurrency)])
+        family("paused", "gauge", "1 while the bruteforce waits for the base domain to resolve",
+               [("paused", int(model.dns_not_working.is_set()))])
+
+        buckets, seen = [], 0
+        for bound, number in zip(LatencyHistogram.BOUNDS, counts):
+            seen += number
+            buckets.append(("lookup_duration_seconds_bucket", seen, {"le": f"{bound:.6g}"}))
+        family("lookup_duration_seconds", "histogram", "Latency of the lookups",
+               buckets + [("lookup_duration_seconds_bucket", count, {"le": "+Inf"}),
+                          ("lookup_duration_seconds_sum", total), ("lookup_duration_seconds_count", count)])
+
+        samples, failures = [], []
+        for resolver, (quantiles, number, seconds, failed) in resolvers.items():
+            samples += [("resolver_duration_seconds", value, {"resolver": resolver, "quantile": q})
+                        for q, value in zip(("0.5", "0.9", "0.99"), quantiles)]
+            samples += [("resolver_duration_seconds_sum", seconds, {"resolver": resolver}),
+                        ("resolver_duration_seconds_count", number, {"resolver": resolver})]
+            failures.append(("resolver_failures_total", failed, {"resolver": resolver}))
+        family("resolver_duration_seconds", "summary", "Latency of the lookups by resolver, the quantiles are "
+               "upper bounds of the buckets of the latency histogram", samples)
+        family("resolver_failures_total", "counter", "Lookups failed by resolver, timeouts or server failures",
+               failures)
+
+        if model.wildcards:
+            family("wildcard_matches_total", "counter", "Subdomains discarded as wildcard matches",
+                   [("wildcard_matches_total", model.wildcards.discarded)])
+        if model.cache:
+            cache = model.cache.status()
+            family("cache_hits_total", "counter", "Lookups answered by the cache",
+                   [("cache_hits_total", cache["hits"])])
+            family("cache_misses_total", "counter", "Lookups not in the cache",
+                   [("cache_misses_total", cache["misses"])])
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Answers GET /metrics with the exposition of the MetricsServer"""
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics_server.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """The scrapes are not logged, they would clutter the console"""
+
+
+class ResultWriter(object):
+    """Appends lines to a file from a dedicated thread, through a buffered file handle.
+
+    The file is flushed and synced to disk at most every flush_interval seconds, and when the writer is closed,
+    so a burst of results costs a few large writes instead of opening the file for every line."""
+
+    def __init__(self, file_name: str, flush_interval: float = 1.0, buffer_size: int = 1 << 16):
+        self.file = open(file_name, "a", buffering=buffer_size)
+        self.flush_interval = flush_interval
+        self.lines: queue.Queue = queue.Queue()
+        self.thread = Model.start_daemon_thread(self.run)
+
+    def write(self, line: str) -> None:
+        self.lines.put(line)
+
+    def flush(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def run(self) -> None:
+        """Writes the queued lines until a None sentinel is received, flushing the written ones periodically.
+
+        This function is always used as a thread"""
+
+        last_flush, written = time.monotonic(), False
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.0, last_flush + self.flush_interval - time.monotonic()))
+            except queue.Empty:
+                line = ""
+            if line is None:  # sentinel: the writer is closed
+                break
+            if line:
+                self.file.write(line + "\n")
+                written = True
+            if written and time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                written = False
+            if not written:
+                last_flush = time.monotonic()
+
+        self.flush()
+        self.file.close()
+
+    def close(self) -> None:
+        """Writes the remaining lines and closes the file"""
+
+        self.lines.put(None)
+        self.thread.join()
 
 
 class ConsoleView(object):
     """This class controls the interaction with the user using the CLI"""
 
-    def __init__(self, result_file: str = None):
+    def __init__(self, result_file: str = None, output_format: str = "text"):
         self.result_file: str = result_file
+        self.output_format: str = output_format  # text: one subdomain per line, ndjson: one JSON object per line
+        self.writer = ResultWriter(result_file) if result_file is not None else None
 
     @staticmethod
     def start() -> None:
         print("Started. Press ENTER to check current status...")
 
-    def found_subdomain(self, subdomain: str) -> None:
+    def found_subdomain(self, subdomain: str, answer: Answer = None) -> None:
         print(f"{datetime.datetime.now()} FOUND {subdomain}")
-        if self.result_file is not None:
-            with open(self.result_file, "a") as f:
-                f.write(subdomain + "\n")
+        if self.writer is not None:
+            self.writer.write(self.format_result(subdomain, answer))
+
+    def format_result(self, subdomain: str, answer: Answer = None) -> str:
+        """Returns the line of the output file for a found subdomain"""
+
+        if self.output_format != "ndjson":
+            return subdomain
+
+        answer = answer or Answer([])
+        return json.dumps({
+            "name": subdomain,
+            "addresses": answer.addresses,
+            "records": [{"name": name, "type": DNSMessage.TYPE_NAMES.get(record_type, record_type), "ttl": ttl,
+                         "value": value} for name, record_type, ttl, value in answer.records],
+            "ttl": answer.ttl,                      # lowest TTL of the records, None if unknown
+            "latency": answer.latency,              # seconds, None if the answer comes from the cache
+            "resolver": answer.resolver,
+            "time": datetime.datetime.now().isoformat(),
+        })
 
     @staticmethod
     def dns_not_working() -> None:
@@ -229,45 +2211,138 @@ class ConsoleView(object):
 
     def completed(self, subdomains: Set[str]) -> None:
         print(f"{datetime.datetime.now()} COMPLETED {subdomains}")
-        if self.result_file is not None:
-            with open(self.result_file, "w") as f:
-                f.write(str(subdomains))
+        self.close()
+
+    def close(self) -> None:
+        """Writes the pending results to the output file and closes it"""
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
     @staticmethod
     def print_status(status: dict) -> None:
         print(status)
 
 
-def parse_arguments() -> dict:
-    """Parse arguments passed by CLI.
-
-    Return a dictionary containing the value of all arguments"""
+def argument_parser() -> argparse.ArgumentParser:
+    """Return the parser of the arguments passed by CLI"""
 
     parser = argparse.ArgumentParser(description="A program to bruteforce subdomains")
     parser.add_argument("domain", help="The domain to bruteforce", type=str, nargs=1)
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group()
     group.add_argument("--file", "-f", help="Bruteforce subdomains from file", type=str)
     group.add_argument("--generator", "-g", help="Bruteforce subdomains generating all combination of letters", type=int)
     parser.add_argument("--from", help="Skip all previous strings", type=str)
+    parser.add_argument("--from-index", help="Skip the first N strings", type=int)
+    parser.add_argument("--index", help="Seek --from and --from-index in the file using a sidecar index FILE.idx, "
+                        "built on the first use", action="store_true")
+    parser.add_argument("--shard", help="Bruteforce only the K-th of N equal slices of the words, counting from 0",
+                        type=Controller.parse_shard, metavar="K/N")
     parser.add_argument("--output", "-o", help="Output file for found subdomains", type=str)
-    parser.add_argument("--thread-limit", "-t", help="Maximum number of threads", type=int, default=100)
-    return vars(parser.parse_args())
+    parser.add_argument("--format", help="Format of the output file: one subdomain per line, or one JSON object per "
+                        "line with the records, the latency and the resolver", choices=["text", "ndjson"],
+                        default="text")
+    parser.add_argument("--thread-limit", "-t", help="Number of worker threads, or of in-flight queries with the "
+                        "async engine", type=int, default=100)
+    parser.add_argument("--engine", "-e", help="Resolver engine: system resolver with a thread pool, or raw UDP "
+                        "queries from an asyncio loop", choices=["system", "async"], default="system")
+    parser.add_argument("--adaptive", "-a", help="Adapt the number of in-flight queries to the health of the "
+                        "resolvers (AIMD), up to --thread-limit", action="store_true")
+    parser.add_argument("--resolvers", "-r", help="File with the IP addresses of the nameservers to spread the "
+                        "queries over, one per line (requires the async engine)", type=str)
+    parser.add_argument("--types", help="Comma-separated record types queried for every subdomain, among A, AAAA "
+                        "and CNAME (default is A; CNAME requires the async engine)", type=Controller.parse_types,
+                        default=(DNSMessage.A,), metavar="TYPES")
+    parser.add_argument("--rate", help="Maximum number of queries per second", type=float)
+    parser.add_argument("--resolver-rate", help="Maximum number of queries per second to each nameserver "
+                        "(requires the async engine)", type=float)
+    parser.add_argument("--burst", help="Maximum number of queries sent at once within the rates (default is one "
+                        "second of queries)", type=float)
+    parser.add_argument("--max-attempts", help="Number of lookups of a subdomain before giving up, when they time out "
+                        "or the nameserver fails (default is 3)", type=int, default=3)
+    parser.add_argument("--retry-delay", help="Maximum number of seconds before the second lookup of a subdomain, "
+                        "doubled at every attempt up to 30, the actual delay is random (default is 0.5)", type=float,
+                        default=0.5)
+    parser.add_argument("--probe-interval", help="Minimum number of seconds between two checks of the base domain, "
+                        "made when many lookups fail (default is 5)", type=float, default=5.0)
+    parser.add_argument("--cache", help="SQLite file caching the answers across runs", type=str)
+    parser.add_argument("--cache-ttl", help="Minimum number of seconds to cache the answers, also used when the "
+                        "resolver provides no TTL (default is one day)", type=int, default=86400)
+    parser.add_argument("--keep-wildcards", help="Do not discard the subdomains resolved by wildcard records",
+                        action="store_true")
+    parser.add_argument("--checkpoint", help="JSON file where the progress is saved periodically", type=str)
+    parser.add_argument("--checkpoint-interval", help="Number of seconds between two checkpoints (default is 60)",
+                        type=float, default=60.0)
+    parser.add_argument("--resume", help="Resume the bruteforce saved in the checkpoint file, with its word source",
+                        type=str, metavar="CHECKPOINT")
+    parser.add_argument("--metrics-port", help="Serve the metrics in the Prometheus text format over HTTP on this "
+                        "port, at /metrics", type=int, metavar="PORT")
+    return parser
+
+
+def parse_arguments() -> dict:
+    """Parse arguments passed by CLI.
+
+    Return a dictionary containing the value of all arguments"""
+
+    parser = argument_parser()
+    args = vars(parser.parse_args())
+
+    if not args["resume"] and not args["file"] and not args["generator"]:
+        parser.error("one of the arguments --file/-f --generator/-g is required")
+    if args["thread_limit"] < 1:
+        parser.error("--thread-limit must be at least 1")
+    if args["resolvers"] and args["engine"] != "async":
+        parser.error("--resolvers requires --engine async")
+    if args["resolver_rate"] and args["engine"] != "async":
+        parser.error("--resolver-rate requires --engine async")
+    if DNSMessage.CNAME in args["types"] and args["engine"] != "async":
+        parser.error("--types CNAME requires --engine async")
+    return args
 
 
 def main():
     args = parse_arguments()
+
+    checkpoint = None
+    if args["resume"]:
+        checkpoint = Checkpoint.load(args["resume"], args["checkpoint_interval"])
+        if checkpoint.config["domain"] != args["domain"]:
+            raise ValueError(f"The checkpoint is for the domain {checkpoint.config['domain'][0]}")
+        args.update(checkpoint.config, shard=tuple(checkpoint.config["shard"]) if checkpoint.config["shard"] else None)
+        checkpoint.file_name = args["checkpoint"] or args["resume"]
+    elif args["checkpoint"]:
+        config = {key: args[key] for key in ("domain", "file", "generator", "from", "from_index", "index", "shard")}
+        checkpoint = Checkpoint(args["checkpoint"], config, args["checkpoint_interval"])
+    position = checkpoint.position if checkpoint else 0  # the words taken by the resumed bruteforce are skipped
+    if args["file"] and zstandard is None and Controller.is_zstd(args["file"]):  # fail before the bruteforce starts
+        argument_parser().error(f"the zstandard package is required to read {args['file']}")
+
     domain = args["domain"][0]
     start_from = args["from"] if args["from"] else None
-    view = ConsoleView(args["output"] if args["output"] else None)
+    view = ConsoleView(args["output"] if args["output"] else None, args["format"])
 
     if args["file"]:
-        words = Controller.get_words_from_file(args["file"], start_from)
+        words = Controller.get_word_batches_from_file(args["file"], start_from, args["from_index"] or 0, args["shard"],
+                                                      args["index"], skip=position)
     elif args["generator"]:
-        words = Controller.generate_word(args["generator"], start_from)
+        words = Controller.generate_word(args["generator"], start_from, start=args["from_index"], shard=args["shard"],
+                                         skip=position)
     else:
         raise ValueError("No word source provided")
 
-    controller = Controller(domain, view, words, args["thread_limit"])
+    cache = ResultCache(args["cache"], args["cache_ttl"], types=args["types"]) if args["cache"] else None
+
+    if args["engine"] == "async":
+        nameservers = Controller.get_resolvers_from_file(args["resolvers"]) if args["resolvers"] else None
+        resolver = UDPResolver(nameservers, rate=args["resolver_rate"], burst=args["burst"], types=args["types"])
+    else:
+        resolver = SystemResolver(args["types"])
+
+    controller = Controller(domain, view, words, args["thread_limit"], resolver, args["adaptive"], args["rate"],
+                            args["burst"], args["probe_interval"], not args["keep_wildcards"], cache, checkpoint,
+                            args["max_attempts"], args["retry_delay"], args["metrics_port"], batched=bool(args["file"]))
 
 
 if __name__ == "__main__":
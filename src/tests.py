@@ -1,9 +1,143 @@
+import argparse
+import asyncio
+import bz2
+import contextlib
+import gzip
+import io
+import json
+import lzma
 import os
+import socket
+import struct
+import sys
+import threading
+import time
 import unittest
-from subdomain_bruteforce import Model, Controller
+import urllib.error
+import urllib.request
+from typing import Dict
+from subdomain_bruteforce import Model, Controller, DNSMessage, UDPResolver, MemoryResolver, ResolveError, \
+    Nameserver, NameserverPool, AIMDLimiter, TokenBucket, HealthProbe, EventBus, \
+    WildcardDetector, Answer, ResultCache, WordlistIndex, zstandard, \
+    Checkpoint, ResultWriter, ConsoleView, Outcome, RetryScheduler, LatencyHistogram, RateWindow, Metrics, \
+    MetricsServer, AsyncResolver
+import benchmarks
+import subdomain_bruteforce
+from dns_stub import StubDNSServer
 
 
-class Tests(unittest.TestCase):
+def dns_response(query: bytes, rcode: int, address: str = None, record_type: int = DNSMessage.A) -> bytes:
+    """Builds the response to a query, with a record of the question name if address is set: an A or AAAA record
+    with the address, or a CNAME record with the target name"""
+
+    question = query[12:]
+    answer = b""
+    if address is not None:
+        if record_type == DNSMessage.CNAME:
+            data = b"".join(bytes([len(label)]) + label.encode() for label in address.split(".")) + b"\x00"
+        else:
+            data = socket.inet_pton(socket.AF_INET6 if record_type == DNSMessage.AAAA else socket.AF_INET, address)
+        answer = b"\xc0\x0c" + struct.pack("!HHIH", record_type, 1, 300, len(data)) + data
+    header = struct.pack("!HHHHHH", struct.unpack("!H", query[:2])[0], 0x8180 | rcode, 1, int(bool(answer)), 0, 0)
+    return header + question + answer
+
+
+def start_udp_responder(records: dict, drop: set = (), default: str = None) -> socket.socket:
+    """Starts a thread answering A queries from the records dict, or with the default address, ignoring the names
+    in drop. A record of the dict can also be a dict of values by record type, answering the queries of any type"""
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+
+    def serve():
+        while True:
+            try:
+                query, addr = sock.recvfrom(512)
+            except OSError:  # socket closed
+                return
+            name, offset = DNSMessage.read_name(query, 12)
+            if name in drop:
+                continue
+            address, query_type = records.get(name, default), struct.unpack_from("!H", query, offset)[0]
+            if isinstance(address, dict):  # NODATA if there is no record of the type
+                response = dns_response(query, DNSMessage.NOERROR, address.get(query_type), query_type)
+            else:
+                response = dns_response(query, DNSMessage.NOERROR if address else DNSMessage.NXDOMAIN, address)
+            sock.sendto(response, addr)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return sock
+
+
+class BannedResolver(MemoryResolver):
+    """A resolver failing every lookup after the first ban_after lookups, until the base domain has been probed
+    probes times: the ban is lifted by the probes, whatever the timing of the bruteforce"""
+
+    def __init__(self, records, base_domain, ban_after, probes=2):
+        super().__init__(records, latency=0.001)
+        self.base_domain, self.ban_after, self.probes = base_domain, ban_after, probes
+        self.lookups = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, domain):
+        with self.lock:
+            self.lookups += 1
+            banned = self.lookups > self.ban_after and self.probes > 0
+            if banned and domain == self.base_domain:
+                self.probes -= 1
+                banned = self.probes > 0
+        answer = super().resolve(domain)
+        if banned:
+            raise ResolveError(domain)
+        return answer
+
+
+class FlakyResolver(MemoryResolver):
+    """A resolver failing the first failures lookups of every domain"""
+
+    def __init__(self, records, failures, outcome=Outcome.TIMEOUT):
+        super().__init__(records)
+        self.failures, self.outcome = failures, outcome
+        self.lookups: Dict[str, int] = {}
+
+    def resolve(self, domain):
+        self.lookups[domain] = self.lookups.get(domain, 0) + 1
+        if self.lookups[domain] <= self.failures:
+            raise ResolveError(domain, self.outcome)
+        return super().resolve(domain)
+
+
+class FaultyResolver(MemoryResolver):
+    """A resolver raising an unexpected exception for the domains starting with "broken" """
+
+    def resolve(self, domain):
+        if domain.startswith("broken"):
+            raise ValueError(domain)
+        return super().resolve(domain)
+
+
+class WildcardResolver(MemoryResolver):
+    """A resolver answering with the wildcard address for the unknown subdomains of the wildcard domain"""
+
+    def __init__(self, records, wildcard_domain, wildcard_address):
+        super().__init__(records)
+        self.wildcard_domain, self.wildcard_address = wildcard_domain, wildcard_address
+
+    def resolve(self, domain):
+        if domain not in self.records and domain.endswith("." + self.wildcard_domain):
+            return Answer([self.wildcard_address])
+        return super().resolve(domain)
+
+
+# the zone answered by the stub resolvers of the offline tests
+ZONE = {"google.com": ["10.0.0.1"], "maps.google.com": ["10.0.0.2"], "drive.google.com": ["10.0.0.3"],
+        "apple.com": ["10.0.1.1"]}
+
+
+@unittest.skipUnless(os.environ.get("NETWORK_TESTS"), "network tests, run them with NETWORK_TESTS=1")
+class NetworkTests(unittest.TestCase):
+    """The same checks as the offline tests, through the system resolver and the live DNS"""
 
     def test_domain_resolving(self):
         self.assertTrue(Model.domain_exists("google.com"))
@@ -16,6 +150,35 @@ class Tests(unittest.TestCase):
         bruteforcer.bruteforce_thread.join()
         self.assertEqual({"maps.google.com", "drive.google.com"}, set(bruteforcer.found_subdomains))
 
+    def test_controller_and_bruteforcer(self):
+        controller = Controller("google.com", None, words=["cieufhcne", "maps", "oicunf", "drive"])
+        controller.model.bruteforce_thread.join()
+        self.assertEqual({"maps.google.com", "drive.google.com"}, set(controller.model.found_subdomains))
+
+
+class Tests(unittest.TestCase):
+
+    def test_domain_resolving(self):
+        resolver = MemoryResolver(ZONE)
+        self.assertTrue(Model.domain_exists("google.com", resolver))
+        self.assertFalse(Model.domain_exists("cerywibfuyviuedyivuyv.com", resolver))
+        self.assertTrue(Model.domain_exists("apple.com", resolver))
+        self.assertFalse(Model.domain_exists("pibowcq.com", resolver))
+        self.assertFalse(Model.domain_exists("google.com", BannedResolver(ZONE, "example.com", ban_after=0)))
+
+    def test_bruteforce(self):
+        with StubDNSServer(dict(ZONE, **{"xn--bcher-kva.google.com": ["10.0.0.4"]})) as server:
+            bruteforcer = Model("google.com", None, ["cieufhcne", "maps", "oicunf", "drive", "bücher"],
+                                resolver=UDPResolver([server.address], timeout=0.5))
+            bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.google.com", "drive.google.com", "bücher.google.com"},
+                         set(bruteforcer.found_subdomains))
+        self.assertEqual(bruteforcer.metrics.outcomes[Outcome.TIMEOUT], 0)  # the IDNA names are answered
+
+        bruteforcer = Model("google.com", None, ["cieufhcne", "maps", "oicunf", "drive"], resolver=MemoryResolver(ZONE))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.google.com", "drive.google.com"}, set(bruteforcer.found_subdomains))
+
     def test_generate_word(self):
         self.assertEqual(sum(1 for _ in Controller.generate_word(3)), 17576)
         self.assertEqual(sum(1 for _ in Controller.generate_word(4)), 456976)
@@ -32,6 +195,45 @@ class Tests(unittest.TestCase):
         self.assertEqual(next(generator2), "fjm")
         self.assertEqual(next(generator2), "fjn")
 
+    def test_generate_word_resume(self):
+        self.assertEqual(Controller.word_index("aaa"), 0)
+        self.assertEqual(Controller.word_index("fjl"), 5 * 676 + 9 * 26 + 11)
+        self.assertEqual(Controller.index_word(5 * 676 + 9 * 26 + 11, 3), "fjl")
+        for index in (0, 1, 25, 26, 12345, 17575):
+            self.assertEqual(Controller.word_index(Controller.index_word(index, 3)), index)
+
+        all_words = list(Controller.generate_word(3))
+        self.assertEqual(all_words, sorted(all_words))
+        self.assertEqual(list(Controller.generate_word(3, "fjy")), all_words[Controller.word_index("fjy"):])
+        self.assertEqual(list(Controller.generate_word(3, "fjz"))[:3], ["fjz", "fka", "fkb"])
+        self.assertEqual(list(Controller.generate_word(3, "fzz"))[:2], ["fzz", "gaa"])
+        self.assertEqual(list(Controller.generate_word(3, start=100, stop=200)), all_words[100:200])
+        self.assertEqual(list(Controller.generate_word(3, start=17575)), ["zzz"])
+        self.assertEqual(list(Controller.generate_word(2, alphabet="ab")), ["aa", "ab", "ba", "bb"])
+
+    def test_shards(self):
+        self.assertEqual(Controller.parse_shard("1/4"), (1, 4))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            Controller.parse_shard("4/4")
+
+        all_words = list(Controller.generate_word(3))
+        shards = [list(Controller.generate_word(3, shard=(k, 7))) for k in range(7)]
+        self.assertEqual(sum(shards, []), all_words)
+        self.assertLessEqual(max(map(len, shards)) - min(map(len, shards)), 1)
+        self.assertEqual(list(Controller.generate_word(3, "zzy", shard=(6, 7))), ["zzy", "zzz"])
+        self.assertEqual(list(Controller.generate_word(3, "aaa", shard=(6, 7)))[0], shards[6][0])
+
+        file_name = "testfile.txt"
+        with open(file_name, "w") as f:
+            f.write("Lorem\nipsum\ndolor\nsit\namet")
+
+        self.assertEqual(list(Controller.get_words_from_file(file_name, shard=(0, 2))), ["Lorem", "dolor", "amet"])
+        self.assertEqual(list(Controller.get_words_from_file(file_name, shard=(1, 2))), ["ipsum", "sit"])
+        self.assertEqual(list(Controller.get_words_from_file(file_name, "ipsum", shard=(0, 2))), ["dolor", "amet"])
+        self.assertEqual(list(Controller.get_words_from_file(file_name, start=3)), ["sit", "amet"])
+
+        os.remove(file_name)
+
     def test_word_from_file(self):
         file_name = "testfile.txt"
         file_content = "Lorem ipsum dolor sit amet"
@@ -43,6 +245,125 @@ class Tests(unittest.TestCase):
 
         os.remove(file_name)
 
+    def test_word_from_file_index(self):
+        file_name = "testfile.txt"
+        words = [f"word{i}" for i in range(5000)]
+        with open(file_name, "w") as f:
+            f.write("\n".join(words))
+
+        index = WordlistIndex(file_name, step=100)
+        self.assertEqual(index.line_offset(250), (200, sum(len(word) + 1 for word in words[:200])))
+        self.assertEqual(index.word_offset("word4321"), (4321, sum(len(word) + 1 for word in words[:4321])))
+        self.assertIsNone(index.word_offset("missing"))
+        index.close()
+
+        for start, start_from, shard in [(2500, None, None), (0, "word4321", None), (4000, "word10", None),
+                                         (0, "missing", None), (1234, None, (1, 3))]:
+            expected = list(Controller.get_words_from_file(file_name, start_from, start, shard))
+            self.assertEqual(list(Controller.get_words_from_file(file_name, start_from, start, shard, True)), expected)
+            for skip in (1, 250, 10_000):  # the words taken by a resumed bruteforce
+                for use_index in (False, True):
+                    self.assertEqual(list(Controller.get_words_from_file(file_name, start_from, start, shard,
+                                                                         use_index, skip)), expected[skip:])
+        self.assertEqual(next(Controller.get_words_from_file(file_name, "word4321", use_index=True)), "word4321")
+
+        with open(file_name, "a") as f:  # the index is rebuilt when the file changes
+            f.write("\nlast")
+        self.assertEqual(list(Controller.get_words_from_file(file_name, "last", use_index=True)), ["last"])
+
+        # the shards of a bruteforce build the missing index at the same time
+        os.remove(file_name + ".idx")
+        errors = []
+
+        def build():
+            try:
+                WordlistIndex(file_name).close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual([name for name in os.listdir(".") if name.startswith(file_name + ".idx.")], [])
+
+        with open(file_name + ".idx", "w") as f:  # a corrupted index is rebuilt
+            f.write("not an index")
+        index = WordlistIndex(file_name)
+        self.assertEqual(index.word_offset("word1"), (1, 6))
+        index.close()
+        os.remove(file_name + ".idx")
+
+        os.mkdir(file_name + ".idx")  # an index which cannot be opened is not used
+        with self.assertLogs("subdomain_bruteforce", "WARNING"):
+            self.assertEqual(next(Controller.get_words_from_file(file_name, "word4321", use_index=True)), "word4321")
+        os.rmdir(file_name + ".idx")
+        os.remove(file_name)
+
+    def test_word_batches_from_file(self):
+        file_name = "testfile.txt"
+        with open(file_name, "w", newline="") as f:
+            f.write("Lorem\r\n ipsum \n\ndolor\nsit\namet\nconsectetur\nadipiscing\nelit")
+        with open(file_name, "r") as f:
+            expected = [line.strip(" \n") for line in f]
+
+        for chunk_size in (1, 7, 1 << 20):
+            batches = list(Controller.get_word_batches_from_file(file_name, chunk_size=chunk_size))
+            self.assertEqual(sum(batches, []), expected)
+            for start, start_from, shard in [(3, None, None), (0, "dolor", None), (0, "ipsum", (1, 3)),
+                                             (5, None, (0, 2)), (0, "missing", None), (20, None, None)]:
+                batches = Controller.get_word_batches_from_file(file_name, start_from, start, shard,
+                                                                chunk_size=chunk_size)
+                words = expected[start:]
+                words = words[words.index(start_from):] if start_from in words else [] if start_from else words
+                first = len(expected) - len(words)
+                self.assertEqual(sum(batches, []), [word for i, word in enumerate(words, first)
+                                                    if shard is None or i % shard[1] == shard[0]])
+
+        os.remove(file_name)
+
+    def test_word_batches_from_compressed_file(self):
+        words = ["Lorem", "ipsum", "", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+        content = "\r\n".join(words).encode()
+        compressions = [gzip.compress, bz2.compress, lzma.compress]
+        if zstandard is not None:
+            compressions.append(zstandard.ZstdCompressor().compress)
+
+        file_name = "testfile.txt.gz"
+        for compress in compressions:
+            with open(file_name, "wb") as f:
+                f.write(compress(content))
+            self.assertIsNotNone(Controller.open_compressed(file_name))
+            for chunk_size in (1, 7, 1 << 20):
+                batches = Controller.get_word_batches_from_file(file_name, chunk_size=chunk_size)
+                self.assertEqual(sum(batches, []), words)
+                batches = Controller.get_word_batches_from_file(file_name, "dolor", 1, (1, 2), chunk_size=chunk_size)
+                self.assertEqual(sum(batches, []), ["dolor", "amet", "adipiscing"])
+                batches = Controller.get_word_batches_from_file(file_name, "ipsum", 2, chunk_size=chunk_size)
+                self.assertEqual(sum(batches, []), [])
+                batches = Controller.get_word_batches_from_file(file_name, start=1, chunk_size=chunk_size, skip=4)
+                self.assertEqual(sum(batches, []), words[5:])
+            self.assertEqual(list(Controller.get_words_from_file(file_name, start=7, use_index=True)),
+                             ["adipiscing", "elit"])
+            self.assertEqual(Controller.is_zstd(file_name), compress not in (gzip.compress, bz2.compress, lzma.compress))
+
+        # without the zstandard package, a zstd wordlist is rejected before the bruteforce starts
+        with open(file_name, "wb") as f:
+            f.write(Controller.ZSTD_MAGIC + bytes(8))
+        module_zstandard, subdomain_bruteforce.zstandard = subdomain_bruteforce.zstandard, None
+        argv, sys.argv = sys.argv, ["subdomain_bruteforce.py", "example.com", "--file", file_name]
+        try:
+            with contextlib.redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit) as context:
+                subdomain_bruteforce.main()
+        finally:
+            subdomain_bruteforce.zstandard, sys.argv = module_zstandard, argv
+        self.assertEqual(context.exception.code, 2)
+        self.assertIn("the zstandard package is required", stderr.getvalue())
+
+        os.remove(file_name)
+
     def test_word_from_file_start_from(self):
         file_name = "testfile.txt"
         file_content = "Lorem ipsum dolor sit amet"
@@ -55,10 +376,724 @@ class Tests(unittest.TestCase):
         os.remove(file_name)
 
     def test_controller_and_bruteforcer(self):
-        controller = Controller("google.com", None, words=["cieufhcne", "maps", "oicunf", "drive"])
+        controller = Controller("google.com", None, words=["cieufhcne", "maps", "oicunf", "drive"],
+                                resolver=MemoryResolver(ZONE))
         controller.model.bruteforce_thread.join()
         self.assertEqual({"maps.google.com", "drive.google.com"}, set(controller.model.found_subdomains))
 
+    def test_controller_bruteforce_failure(self):
+        def words():
+            yield "maps"
+            raise OSError("the wordlist cannot be read")
+
+        # without a terminal, the controller waits for the completion, which is notified even if the bruteforce fails
+        stdin, sys.stdin = sys.stdin, io.StringIO()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as stdout, self.assertLogs("subdomain_bruteforce", "ERROR"):
+                with self.assertRaises(SystemExit) as context:
+                    Controller("google.com", ConsoleView(), words(), resolver=MemoryResolver(ZONE))
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn(" COMPLETED ", stdout.getvalue())
+
+    def test_dns_message(self):
+        query = DNSMessage.build_query(0x1234, "maps.example.com")
+        self.assertEqual(query[:12], bytes.fromhex("123401000001000000000000"))
+        self.assertEqual(query[12:], b"\x04maps\x07example\x03com\x00\x00\x01\x00\x01")
+
+        query_id, rcode, question, answers = DNSMessage.parse_response(dns_response(query, 0, "10.0.0.1"))
+        self.assertEqual((query_id, rcode, question), (0x1234, DNSMessage.NOERROR, "maps.example.com"))
+        self.assertEqual(answers, [("maps.example.com", DNSMessage.A, 300, "10.0.0.1")])
+
+        rcode = DNSMessage.parse_response(dns_response(query, DNSMessage.NXDOMAIN))[1]
+        self.assertEqual(rcode, DNSMessage.NXDOMAIN)
+
+    def test_udp_resolver(self):
+        server = start_udp_responder({"maps.example.com": "10.0.0.1"}, drop={"slow.example.com"})
+
+        async def resolve():
+            resolver = UDPResolver([server.getsockname()], timeout=0.5)
+            await resolver.open()
+            try:
+                answer = await resolver.resolve("maps.example.com")
+                records = (("maps.example.com", DNSMessage.A, 300, "10.0.0.1"),)
+                self.assertEqual(answer, Answer(["10.0.0.1"], 300, records, "%s:%d" % server.getsockname()))
+                self.assertEqual((await resolver.resolve("oicunf.example.com")).addresses, [])
+                with self.assertRaises(ResolveError):
+                    await resolver.resolve("slow.example.com")
+            finally:
+                resolver.close()
+
+        asyncio.run(resolve())
+        server.close()
+
+    def test_record_types(self):
+        server = start_udp_responder({"example.com": "10.0.0.1", "maps.example.com": "10.0.0.2",
+                                      "ipv6.example.com": {DNSMessage.AAAA: "2001:db8::1"},
+                                      "dangling.example.com": {DNSMessage.CNAME: "gone.example.net"}})
+        words = ["maps", "ipv6", "dangling", "oicunf"]
+        types = Controller.parse_types("a, AAAA,cname")
+        self.assertEqual(types, (DNSMessage.A, DNSMessage.AAAA, DNSMessage.CNAME))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            Controller.parse_types("A,MX")
+
+        bruteforcer = Model("example.com", None, words, resolver=UDPResolver([server.getsockname()], types=types))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com", "ipv6.example.com", "dangling.example.com"},
+                         bruteforcer.found_subdomains)
+
+        bruteforcer = Model("example.com", None, words, resolver=UDPResolver([server.getsockname()]))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com"}, bruteforcer.found_subdomains)
+        server.close()
+
+        file_name = "testcache.sqlite"
+        cache = ResultCache(file_name)
+        cache.put("dangling.example.com", Answer([], records=(("dangling.example.com", DNSMessage.CNAME, 300,
+                                                                "gone.example.net"),)))
+        self.assertEqual(cache.get("dangling.example.com").targets, ["gone.example.net"])
+        cache.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(file_name + suffix):
+                os.remove(file_name + suffix)
+
+    def test_outcomes(self):
+        server = start_udp_responder({"maps.example.com": "10.0.0.1",
+                                      "mail.example.com": {DNSMessage.AAAA: "2001:db8::1"}}, drop={"slow.example.com"})
+
+        async def resolve():
+            resolver = UDPResolver([server.getsockname()], timeout=0.2)
+            await resolver.open()
+            try:
+                self.assertEqual((await resolver.resolve("maps.example.com")).outcome, Outcome.NOERROR)
+                self.assertEqual((await resolver.resolve("mail.example.com")).outcome, Outcome.NODATA)
+                self.assertEqual((await resolver.resolve("oicunf.example.com")).outcome, Outcome.NXDOMAIN)
+                with self.assertRaises(ResolveError) as context:
+                    await resolver.resolve("slow.example.com")
+                self.assertEqual(context.exception.outcome, Outcome.TIMEOUT)
+            finally:
+                resolver.close()
+
+        asyncio.run(resolve())
+        server.close()
+
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"], "drive.example.com": ["10.0.0.3"]}
+        for failures, found in ((2, {"maps.example.com", "drive.example.com"}), (3, set())):
+            resolver = FlakyResolver(records, failures)
+            bruteforcer = Model("example.com", None, ["maps", "oicunf", "drive"], resolver=resolver,
+                                filter_wildcards=False, probe_interval=0.01, max_attempts=3, retry_delay=0.01)
+            bruteforcer.bruteforce_thread.join()
+            self.assertEqual(bruteforcer.found_subdomains, found)
+            self.assertEqual(resolver.lookups["maps.example.com"], 3)
+            self.assertEqual(bruteforcer.retried_count, 6)
+            self.assertEqual(bruteforcer.failed_count, 0 if failures < 3 else 3)
+            self.assertEqual(bruteforcer.metrics.outcomes[Outcome.TIMEOUT], 3 * failures)
+
+    def test_retry_scheduler(self):
+        scheduler = RetryScheduler(base_delay=0.1, max_delay=0.3)
+        scheduler.schedule(0, "maps.example.com", 2)
+        self.assertLessEqual(scheduler.delay(), 0.1)
+        scheduler.schedule(1, "drive.example.com", 5)
+        self.assertEqual(len(scheduler), 2)
+        time.sleep(0.1)
+        due = list(scheduler.due())  # the drive lookup may be due too, it is due at most 0.3 seconds later
+        self.assertIn((0, "maps.example.com", 2), due)
+        self.assertLessEqual(scheduler.delay(), 0.2)
+        time.sleep(0.2)
+        self.assertEqual(sorted(due + list(scheduler.due())),
+                         [(0, "maps.example.com", 2), (1, "drive.example.com", 5)])
+        self.assertEqual((len(scheduler), scheduler.delay()), (0, 0.0))
+
+        # the lookup failed on the first nameserver is retried on the second one, even when it is its turn
+        dropping = start_udp_responder({"maps.example.com": "10.0.0.1"}, drop={"maps.example.com"})
+        answering = start_udp_responder({"maps.example.com": "10.0.0.1"})
+
+        async def resolve():
+            resolver = UDPResolver([dropping.getsockname(), answering.getsockname()], timeout=0.2)
+            await resolver.open()
+            try:
+                with self.assertRaises(ResolveError):
+                    await resolver.resolve("maps.example.com")
+                await resolver.resolve("drive.example.com")
+                self.assertEqual((await resolver.resolve("maps.example.com")).addresses, ["10.0.0.1"])
+            finally:
+                resolver.close()
+
+        asyncio.run(resolve())
+        dropping.close()
+        answering.close()
+
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"]}
+        start = time.monotonic()
+        bruteforcer = Model("example.com", None, ["maps"], resolver=FlakyResolver(records, 2),
+                            filter_wildcards=False, probe_interval=0.01, retry_delay=0.2)
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual(bruteforcer.found_subdomains, {"maps.example.com"})
+        self.assertLess(time.monotonic() - start, 0.2 + 0.4 + 0.1)
+
+    def test_metrics(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.quantile(0.5))
+        for latency in [0.010] * 90 + [0.100] * 9 + [1.0]:
+            histogram.record(latency)
+        for q, latency in ((0.5, 0.010), (0.9, 0.010), (0.99, 0.100), (1.0, 1.0)):
+            self.assertGreaterEqual(histogram.quantile(q), latency)
+            self.assertLess(histogram.quantile(q), latency * 1.25)
+        self.assertEqual(histogram.status()["count"], 100)
+        self.assertAlmostEqual(histogram.status()["mean"], 28.0)
+
+        window = RateWindow(5)
+        window.add(10)
+        window.add()
+        self.assertAlmostEqual(window.rate(), 11 / 5)
+
+        metrics = Metrics()
+        metrics.record("1.1.1.1:53", 0.01, Outcome.NOERROR)
+        metrics.record("1.1.1.1:53", 0.5, Outcome.TIMEOUT)
+        metrics.record(None, 0.02, Outcome.NXDOMAIN)
+        status = metrics.status()
+        self.assertEqual(status["latency"]["count"], 3)
+        resolvers = status["by resolver"]
+        self.assertEqual((resolvers["1.1.1.1:53"]["count"], resolvers["1.1.1.1:53"]["failures"]), (2, 1))
+        self.assertEqual(resolvers["unknown"]["failures"], 0)
+        self.assertEqual(metrics.outcomes[Outcome.TIMEOUT], 1)
+
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"]}
+        controller = Controller("example.com", None, ["maps", "oicunf"], resolver=MemoryResolver(records),
+                                filter_wildcards=False)
+        controller.model.bruteforce_thread.join()
+        status = controller.current_status()
+        self.assertEqual((status["in flight"], status["retry queue"]), (0, 0))
+        self.assertEqual(status["by resolver"]["memory"]["count"], 2)
+        self.assertEqual(status["outcomes"], {"NOERROR": 1, "NODATA": 0, "NXDOMAIN": 1, "SERVFAIL": 0, "TIMEOUT": 0})
+        self.assertGreater(status["lookups/second"], 0)
+
+    def test_metrics_server(self):
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"]}
+        controller = Controller("example.com", None, ["maps", "oicunf"], resolver=MemoryResolver(records),
+                                filter_wildcards=False, metrics_port=0)
+        controller.model.bruteforce_thread.join()
+        try:
+            url = "http://127.0.0.1:%d" % controller.metrics_server.address[1]
+            with urllib.request.urlopen(url + "/metrics") as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+                lines = response.read().decode().splitlines()
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + "/other")
+        finally:
+            controller.metrics_server.close()
+
+        self.assertIn("# TYPE subdomain_bruteforce_lookups_total counter", lines)
+        self.assertIn('subdomain_bruteforce_lookups_total{outcome="NXDOMAIN"} 1', lines)
+        self.assertIn("subdomain_bruteforce_found 1", lines)
+        self.assertIn('subdomain_bruteforce_lookup_duration_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('subdomain_bruteforce_resolver_duration_seconds_count{resolver="memory"} 2', lines)
+        self.assertIn('subdomain_bruteforce_resolver_failures_total{resolver="memory"} 0', lines)
+        buckets = [int(line.split()[-1]) for line in lines
+                   if line.startswith("subdomain_bruteforce_lookup_duration_seconds_bucket")]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(MetricsServer.format_sample("found", 1, {"resolver": 'a"b\\'}),
+                         'subdomain_bruteforce_found{resolver="a\\"b\\\\"} 1')
+
+    def test_nameserver_pool(self):
+        self.assertEqual(Nameserver.parse_address("1.1.1.1"), ("1.1.1.1", 53))
+        self.assertEqual(Nameserver.parse_address("1.1.1.1:5353"), ("1.1.1.1", 5353))
+        self.assertEqual(Nameserver.parse_address("2606:4700:0::1111"), ("2606:4700::1111", 53))
+        self.assertEqual(Nameserver.parse_address("[::1]:5353"), ("::1", 5353))
+
+        pool = NameserverPool([("10.0.0.1", 53), ("10.0.0.2", 53), ("10.0.0.3", 53)])
+        first, second, third = pool.nameservers
+        self.assertEqual([pool.next() for _ in range(4)], [first, second, third, first])
+
+        for _ in range(50):  # the second nameserver never answers, the third one is slow
+            pool.report(first, 0.01, False)
+            pool.report(second, None, True)
+            pool.report(third, 0.5, False)
+        self.assertEqual({pool.next() for _ in range(10)}, {first})
+
+        third.lying = True
+        second.demoted_until = first.demoted_until = 0
+        self.assertEqual({pool.next() for _ in range(10)}, {first, second})
+
+    def test_udp_resolver_pool(self):
+        records = {"maps.example.com": "10.0.0.1"}
+        servers = [start_udp_responder(records), start_udp_responder(records), start_udp_responder(records)]
+        liar = start_udp_responder({}, default="10.6.6.6")
+
+        async def resolve():
+            resolver = UDPResolver([server.getsockname() for server in servers + [liar]], timeout=0.5)
+            await resolver.open()
+            try:
+                self.assertEqual([nameserver.lying for nameserver in resolver.pool.nameservers], [False] * 3 + [True])
+                for _ in range(30):
+                    self.assertEqual((await resolver.resolve("maps.example.com")).addresses, ["10.0.0.1"])
+                self.assertEqual([nameserver.queries for nameserver in resolver.pool.nameservers], [11, 11, 11, 1])
+            finally:
+                resolver.close()
+
+        asyncio.run(resolve())
+        for server in servers + [liar]:
+            server.close()
+
+    def test_aimd_limiter(self):
+        limiter = AIMDLimiter(maximum=50, initial=10)
+        for _ in range(20):  # slow start: one more query per success
+            limiter.record(True, 0.01)
+        self.assertEqual(limiter.limit, 30)
+
+        limiter.record(False)
+        self.assertEqual(limiter.limit, 15)
+        limiter.record(False)  # a second failure within the same round trip is ignored
+        self.assertEqual(limiter.limit, 15)
+
+        for _ in range(16):  # congestion avoidance: one more query per round trip
+            limiter.record(True, 0.01)
+        self.assertEqual(limiter.limit, 16)
+
+        for _ in range(2000):
+            limiter.record(True, 0.01)
+        self.assertEqual(limiter.limit, 50)
+
+        limiter.acquire()
+        self.assertEqual(limiter.in_flight, 1)
+        limiter.release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0.0] * 5)  # the burst
+        self.assertAlmostEqual(bucket.reserve(), 0.01, places=3)
+        self.assertAlmostEqual(bucket.reserve(), 0.02, places=3)
+        self.assertLess(bucket.available(), 0)
+
+        pool = NameserverPool([("10.0.0.1", 53), ("10.0.0.2", 53)], rate=100, burst=1)
+        first, second = pool.nameservers
+        first.bucket.reserve()
+        self.assertEqual([pool.next(), pool.next()], [second, second])
+        second.bucket.reserve()
+        second.bucket.reserve()
+        self.assertEqual(pool.next(), first)
+
+    def test_health_probe(self):
+        probe = HealthProbe(interval=0.05)
+        self.assertTrue(probe.due())  # never probed
+        probe.probed(True)
+        self.assertFalse(probe.due())
+
+        for _ in range(30):
+            probe.record(False)
+        self.assertFalse(probe.due())  # the interval is not elapsed
+        time.sleep(0.05)
+        self.assertTrue(probe.due())
+
+        probe.probed(False)
+        time.sleep(0.05)
+        self.assertTrue(probe.due())  # still failing
+        probe.probed(True)
+        time.sleep(0.05)
+        self.assertFalse(probe.due())
+
+    def test_bruteforce_pause(self):
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"]}
+        resolver = BannedResolver(records, "example.com", ban_after=100)
+        bruteforcer = Model("example.com", None, ["oicunf"] * 2000 + ["maps"], thread_limit=4, resolver=resolver,
+                            probe_interval=0.05)
+        events = []
+        bruteforcer.events.subscribe(lambda event, *args: events.append(event))
+
+        self.assertTrue(bruteforcer.dns_not_working.wait(5))
+        bruteforcer.bruteforce_thread.join()
+        self.assertTrue(bruteforcer.dns_working.is_set())
+        self.assertEqual({"maps.example.com"}, bruteforcer.found_subdomains)
+
+        bruteforcer.events.join()
+        self.assertEqual([event for event in events if event != EventBus.PROGRESS],
+                         [EventBus.PAUSED, EventBus.RESUMED, EventBus.FOUND, EventBus.COMPLETED])
+
+        # a base domain without addresses is a definitive answer, the resolver is working
+        bruteforcer = Model("example.com", None, ["oicunf", "maps"],
+                            resolver=MemoryResolver({"maps.example.com": ["10.0.0.2"]}), filter_wildcards=False)
+        events = []
+        bruteforcer.events.subscribe(lambda event, *args: events.append(event))
+        bruteforcer.bruteforce_thread.join()
+        bruteforcer.events.join()
+        self.assertFalse(bruteforcer.dns_not_working.is_set())
+        self.assertEqual([event for event in events if event != EventBus.PROGRESS],
+                         [EventBus.FOUND, EventBus.COMPLETED])
+
+    def test_invalid_words(self):
+        self.assertTrue(Model.is_valid_domain("maps.example.com."))
+        self.assertTrue(Model.is_valid_domain("bücher.example.com"))
+        for domain in (".example.com", "maps..example.com", "x" * 64 + ".example.com", "x." * 127 + "com"):
+            self.assertFalse(Model.is_valid_domain(domain))
+
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"]}
+        words = [""] * 10 + ["x" * 64] + ["broken%d" % i for i in range(10)] + ["maps"]
+        with self.assertLogs("subdomain_bruteforce", "ERROR") as logs:
+            bruteforcer = Model("example.com", None, words, thread_limit=4, resolver=FaultyResolver(records),
+                                filter_wildcards=False)
+            bruteforcer.bruteforce_thread.join()
+        self.assertEqual(bruteforcer.found_subdomains, {"maps.example.com"})
+        self.assertEqual((bruteforcer.failed_count, len(logs.records)), (10, 10))
+        self.assertEqual(bruteforcer.checked_subdomains_count, 11)
+
+        with self.assertRaises(ValueError):  # no worker would ever take the queued subdomains
+            Model("example.com", None, ["maps"], thread_limit=0, resolver=MemoryResolver(records))
+
+    def test_bruteforce_async(self):
+        server = start_udp_responder({"example.com": "10.0.0.1", "maps.example.com": "10.0.0.2",
+                                      "drive.example.com": "10.0.0.3"})
+        bruteforcer = Model("example.com", None, ["cieufhcne", "maps", "oicunf", "drive"] * 100,
+                            resolver=UDPResolver([server.getsockname()]))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com", "drive.example.com"}, bruteforcer.found_subdomains)
+        server.close()
+
+    def test_event_bus(self):
+        class View(object):
+            def __init__(self):
+                self.found, self.completed_with = [], None
+
+            def found_subdomain(self, subdomain, answer):
+                self.found.append(subdomain)
+
+            def completed(self, subdomains):
+                self.completed_with = subdomains
+
+        view = View()
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"], "drive.example.com": ["10.0.0.3"]}
+        bruteforcer = Model("example.com", view, ["maps", "oicunf", "drive"], resolver=MemoryResolver(records))
+        bruteforcer.bruteforce_thread.join()
+        bruteforcer.events.join()
+        self.assertEqual(sorted(view.found), ["drive.example.com", "maps.example.com"])
+        self.assertEqual(view.completed_with, {"maps.example.com", "drive.example.com"})
+
+        bus = EventBus()
+        bus.publish(EventBus.FOUND, "maps.example.com", None)  # published before the subscription
+        events = []
+        bus.subscribe(lambda event, *args: events.append((event, args)))
+        bus.publish(EventBus.PROGRESS, 10, "drive.example.com")
+        bus.join()
+        self.assertEqual(events, [(EventBus.FOUND, ("maps.example.com", None)),
+                                  (EventBus.PROGRESS, (10, "drive.example.com"))])
+
+        def broken_pipe(event, *args):
+            if event == EventBus.FOUND:
+                raise BrokenPipeError()
+
+        bus = EventBus()
+        events = []
+        bus.subscribe(broken_pipe)
+        bus.subscribe(lambda event, *args: events.append(event))
+        with self.assertLogs("subdomain_bruteforce", "ERROR"):
+            bus.publish(EventBus.FOUND, "maps.example.com", None)
+            bus.publish(EventBus.COMPLETED, {"maps.example.com"})
+            bus.join()
+        self.assertTrue(bus.thread.is_alive())
+        self.assertEqual(events, [EventBus.FOUND, EventBus.COMPLETED])
+
+    def test_wildcard_detector(self):
+        detector = WildcardDetector("example.com")
+        self.assertEqual(detector.levels("a.b.example.com"), ["b.example.com", "example.com"])
+        self.assertEqual(detector.levels("maps.example.com"), ["example.com"])
+
+        resolver = WildcardResolver({"maps.dev.example.com": ["10.0.0.2"]}, "dev.example.com", "10.0.0.9")
+        self.assertFalse(detector.is_wildcard("maps.dev.example.com", ["10.0.0.2"], resolver))
+        self.assertTrue(detector.is_wildcard("oicunf.dev.example.com", ["10.0.0.9"], resolver))
+        self.assertEqual(detector.wildcards, {"dev.example.com": frozenset(["10.0.0.9"]), "example.com": frozenset()})
+        self.assertEqual(detector.discarded, 1)
+
+    def test_bruteforce_wildcards(self):
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"], "www.example.com": ["10.0.0.9"]}
+        words = ["cieufhcne", "maps", "oicunf", "drive", "www"] * 20
+
+        bruteforcer = Model("example.com", None, words, resolver=WildcardResolver(records, "example.com", "10.0.0.9"))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com"}, bruteforcer.found_subdomains)
+        self.assertEqual(bruteforcer.wildcards.discarded, 80)
+
+        addresses = {domain: addresses[0] for domain, addresses in records.items()}
+        server = start_udp_responder(addresses, default="10.0.0.9")
+        bruteforcer = Model("example.com", None, words, resolver=UDPResolver([server.getsockname()]))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com"}, bruteforcer.found_subdomains)
+        server.close()
+
+        bruteforcer = Model("example.com", None, words, resolver=WildcardResolver(records, "example.com", "10.0.0.9"),
+                            filter_wildcards=False)
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual(len(bruteforcer.found_subdomains), 5)
+
+    def test_dns_message_negative_ttl(self):
+        query = DNSMessage.build_query(0x1234, "oicunf.example.com")
+        soa = b"\x02ns\xc0\x13" + b"\x05admin\xc0\x13" + struct.pack("!IIIII", 1, 7200, 3600, 86400, 60)
+        authority = b"\xc0\x13" + struct.pack("!HHIH", DNSMessage.SOA, 1, 900, len(soa)) + soa
+        response = bytearray(dns_response(query, DNSMessage.NXDOMAIN) + authority)
+        response[9] = 1  # one authority record
+
+        records = DNSMessage.parse_response(bytes(response))[3]
+        self.assertEqual(records, [("example.com", DNSMessage.SOA, 60, "ns.example.com")])
+
+    def test_result_cache(self):
+        file_name = "testcache.sqlite"
+        cache = ResultCache(file_name, min_ttl=60)
+        self.assertIsNone(cache.get("maps.example.com"))
+        cache.put("maps.example.com", Answer(["10.0.0.1", "10.0.0.2"], 3600))
+        cache.put("oicunf.example.com", Answer([]))
+        cache.put("old.example.com", Answer([]))
+        cache.connection.execute("UPDATE answers SET expires = 0 WHERE domain = 'old.example.com'")
+        cache.close()
+
+        cache = ResultCache(file_name, min_ttl=60, max_entries=1)
+        self.assertEqual(cache.get("maps.example.com").addresses, ["10.0.0.1", "10.0.0.2"])
+        self.assertIsNone(cache.get("oicunf.example.com"))  # evicted, closest to expire
+        self.assertIsNone(cache.get("old.example.com"))  # expired
+        self.assertEqual(cache.status(), {"hits": 1, "misses": 2})
+        cache.close()
+
+        records = {"example.com": ["10.0.0.1"], "drive.example.com": ["10.0.0.3"]}
+        resolver = MemoryResolver(records)
+        bruteforcer = Model("example.com", None, ["maps", "drive", "oicunf"], resolver=resolver,
+                            cache=ResultCache(file_name))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com", "drive.example.com"}, bruteforcer.found_subdomains)  # maps is cached
+
+        # an answer without addresses cached by an A-only run does not hide the AAAA records
+        cache = ResultCache(file_name, types=(DNSMessage.AAAA, DNSMessage.A))
+        self.assertIsNone(cache.get("oicunf.example.com"))
+        cache.put("oicunf.example.com", Answer(["2001:db8::1"]))
+        cache.close()
+        cache = ResultCache(file_name)
+        self.assertEqual(cache.get("oicunf.example.com").targets, [])
+        cache.close()
+        bruteforcer = Model("example.com", None, ["oicunf"], resolver=resolver,
+                            cache=ResultCache(file_name, types=(DNSMessage.A, DNSMessage.AAAA)))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"oicunf.example.com"}, bruteforcer.found_subdomains)  # the cached AAAA answer
+
+        # a cache keyed by domain only is dropped
+        cache = ResultCache(file_name)
+        cache.connection.execute("DROP TABLE answers")
+        cache.connection.execute("CREATE TABLE answers (domain TEXT PRIMARY KEY, addresses TEXT, expires REAL)")
+        cache.connection.execute("INSERT INTO answers VALUES ('maps.example.com', '10.0.0.1', 1e12)")
+        cache.connection.commit()
+        cache.connection.close()
+        cache = ResultCache(file_name)
+        self.assertIsNone(cache.get("maps.example.com"))
+        cache.close()
+
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(file_name + suffix):
+                os.remove(file_name + suffix)
+
+    def test_bruteforce_memory_resolver(self):
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"], "drive.example.com": ["10.0.0.3"]}
+        words = ["cieufhcne", "maps", "oicunf", "drive"]
+
+        bruteforcer = Model("example.com", None, words, resolver=MemoryResolver(records))
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com", "drive.example.com"}, bruteforcer.found_subdomains)
+
+        bruteforcer = Model("example.com", None, words, resolver=MemoryResolver(records), adaptive=True)
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual({"maps.example.com", "drive.example.com"}, bruteforcer.found_subdomains)
+        self.assertEqual(bruteforcer.concurrency, 14)
+
+        start = time.monotonic()
+        bruteforcer = Model("example.com", None, words * 10, resolver=MemoryResolver(records), rate=200, burst=1)
+        bruteforcer.bruteforce_thread.join()
+        self.assertGreaterEqual(time.monotonic() - start, 39 / 200)
+
+    def test_bruteforce_batches(self):
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"], "drive.example.com": ["10.0.0.3"]}
+        batches = [["cieufhcne", "maps", "", "a" * 64], [f"word{i}" for i in range(600)] + ["drive"]]
+        file_name = "testcheckpoint.json"
+
+        class RecordingResolver(MemoryResolver):
+            def resolve(self, domain):
+                looked_up.append(domain)
+                return super().resolve(domain)
+
+        class RecordingAsyncResolver(AsyncResolver):
+            async def resolve(self, domain):
+                return RecordingResolver(records).resolve(domain)
+
+        for resolver in (RecordingResolver(records), RecordingAsyncResolver()):
+            looked_up = []
+            checkpoint = Checkpoint(file_name, {"domain": ["example.com"]})
+            bruteforcer = Model("example.com", None, batches, resolver=resolver, checkpoint=checkpoint,
+                                filter_wildcards=False, batched=True)
+            bruteforcer.bruteforce_thread.join()
+            self.assertEqual({"maps.example.com", "drive.example.com"}, bruteforcer.found_subdomains)
+            self.assertEqual(bruteforcer.checked_subdomains_count, 603)  # the blank and too long words are skipped
+            self.assertEqual(len(set(looked_up) - {"example.com"}), 603)
+            checkpoint = Checkpoint.load(file_name)
+            self.assertEqual((checkpoint.position, checkpoint.watermark, checkpoint.pending), (605, 605, {}))
+
+        self.assertTrue(Model.all_valid_domains(["maps.example.com", "drive.example.com"]))
+        for domains in (["maps.example.com", ".example.com"], ["a..example.com"], ["a" * 64 + ".example.com"],
+                        ["example.com", "a." * 127 + "com"]):
+            self.assertFalse(Model.all_valid_domains(domains))
+        self.assertTrue(Model.all_valid_domains(["bücher.example.com"]))
+        os.remove(file_name)
+
+    def test_checkpoint(self):
+        file_name = "testcheckpoint.json"
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2"], "drive.example.com": ["10.0.0.3"]}
+        words = ["cieufhcne", "maps", "oicunf", "drive", "mail", "www"]
+
+        for engine in ("system", "async"):
+            resolver = MemoryResolver(records)
+            if engine == "async":
+                sock = start_udp_responder({domain: addresses[0] for domain, addresses in records.items()})
+                resolver = UDPResolver([sock.getsockname()], timeout=0.5)
+            config = {"domain": ["example.com"], "file": "words.txt"}
+            bruteforcer = Model("example.com", None, words, resolver=resolver, checkpoint=Checkpoint(file_name, config))
+            bruteforcer.bruteforce_thread.join()
+            checkpoint = Checkpoint.load(file_name)
+            self.assertEqual((checkpoint.config, checkpoint.position, checkpoint.watermark, checkpoint.found),
+                             (config, 6, 6, {"maps.example.com", "drive.example.com"}))
+
+        # a run stopped after taking 4 words, while the lookup of "oicunf" and "drive" was in flight
+        Checkpoint(file_name, config, position=4, pending={2: "oicunf", 3: "drive"},
+                   found={"maps.example.com"}).save({"maps.example.com"})
+        checkpoint = Checkpoint.load(file_name)
+        self.assertEqual(checkpoint.watermark, 2)
+
+        looked_up = []
+        resolver = MemoryResolver(records)
+        resolver.resolve = lambda domain: looked_up.append(domain) or MemoryResolver.resolve(resolver, domain)
+        bruteforcer = Model("example.com", None, words[checkpoint.position:], resolver=resolver, checkpoint=checkpoint,
+                            filter_wildcards=False)
+        bruteforcer.bruteforce_thread.join()
+        self.assertEqual(sorted(set(looked_up) - {"example.com"}),
+                         ["drive.example.com", "mail.example.com", "oicunf.example.com", "www.example.com"])
+        self.assertEqual(bruteforcer.found_subdomains, {"maps.example.com", "drive.example.com"})
+        checkpoint = Checkpoint.load(file_name)
+        self.assertEqual((checkpoint.position, checkpoint.pending), (6, {}))
+
+        class FaultyAsyncResolver(AsyncResolver):
+            async def resolve(self, domain):
+                return FaultyResolver(records).resolve(domain)
+
+        # a lookup failing unexpectedly is given up, instead of staying pending forever
+        with self.assertLogs("subdomain_bruteforce", "ERROR"):
+            bruteforcer = Model("example.com", None, ["broken", "maps"], resolver=FaultyAsyncResolver(),
+                                checkpoint=Checkpoint(file_name, config), filter_wildcards=False)
+            bruteforcer.bruteforce_thread.join()
+        checkpoint = Checkpoint.load(file_name)
+        self.assertEqual((checkpoint.watermark, checkpoint.pending, bruteforcer.failed_count), (2, {}, 1))
+        self.assertEqual(checkpoint.found, {"maps.example.com"})
+
+        self.assertEqual(list(Controller.generate_word(2, start=3, shard=(1, 4), skip=5)),
+                         list(Controller.generate_word(2, start=169 + 5, stop=338)))
+        os.remove(file_name)
+
+    def test_result_writer(self):
+        file_name = "testresults.txt"
+        with open(file_name, "w") as f:
+            f.write("previous.example.com\n")
+
+        writer = ResultWriter(file_name, flush_interval=0.05)
+        writer.write("maps.example.com")
+        time.sleep(0.2)
+        with open(file_name, "r") as f:
+            self.assertEqual(f.read().splitlines(), ["previous.example.com", "maps.example.com"])
+        writer.write("drive.example.com")
+        writer.close()
+        with open(file_name, "r") as f:
+            self.assertEqual(f.read().splitlines(), ["previous.example.com", "maps.example.com", "drive.example.com"])
+
+        os.remove(file_name)
+        view = ConsoleView(file_name)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:  # the view also prints every subdomain
+            for i in range(1000):
+                view.found_subdomain(f"{i}.example.com")
+            view.completed({f"{i}.example.com" for i in range(1000)})
+        with open(file_name, "r") as f:
+            self.assertEqual(f.read().splitlines(), [f"{i}.example.com" for i in range(1000)])
+        self.assertEqual(stdout.getvalue().count(" FOUND "), 1000)
+
+        os.remove(file_name)
+
+    def test_ndjson_output(self):
+        file_name = "testresults.ndjson"
+        records = {"example.com": ["10.0.0.1"], "maps.example.com": ["10.0.0.2", "10.0.0.3"]}
+        view = ConsoleView(file_name, "ndjson")
+        bruteforcer = Model("example.com", view, ["maps", "oicunf"], resolver=MemoryResolver(records))
+        bruteforcer.bruteforce_thread.join()
+        bruteforcer.events.join()
+
+        with open(file_name, "r") as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["name"], "maps.example.com")
+        self.assertEqual(results[0]["addresses"], ["10.0.0.2", "10.0.0.3"])
+        self.assertEqual(results[0]["records"], [{"name": "maps.example.com", "type": "A", "ttl": None,
+                                                  "value": address} for address in ["10.0.0.2", "10.0.0.3"]])
+        self.assertEqual(results[0]["resolver"], "memory")
+        self.assertGreaterEqual(results[0]["latency"], 0)
+
+        os.remove(file_name)
+
+    def test_stub_server(self):
+        zone = {"example.com": ["10.0.0.1"], "maps.example.com": {"A": ["10.0.0.2"], "AAAA": ["2001:db8::2"]},
+                "www.example.com": {"CNAME": ["maps.example.com"]},
+                "dangling.example.com": {"CNAME": ["gone.example.net"]}, "*.dev.example.com": ["10.0.0.9"]}
+
+        with StubDNSServer(zone) as server:
+            async def resolve():
+                resolver = UDPResolver([server.address], timeout=0.5, types=(DNSMessage.A, DNSMessage.AAAA))
+                await resolver.open()
+                try:
+                    self.assertEqual((await resolver.resolve("maps.example.com")).addresses,
+                                     ["10.0.0.2", "2001:db8::2"])
+                    answer = await resolver.resolve("www.example.com")
+                    self.assertEqual(answer.records[0], ("www.example.com", DNSMessage.CNAME, 300, "maps.example.com"))
+                    self.assertEqual(answer.addresses, ["10.0.0.2", "2001:db8::2"])
+                    self.assertEqual((await resolver.resolve("dangling.example.com")).targets, ["gone.example.net"])
+                    self.assertEqual((await resolver.resolve("a.b.dev.example.com")).addresses, ["10.0.0.9"])
+                    self.assertEqual((await resolver.resolve("oicunf.example.com")).outcome, Outcome.NXDOMAIN)
+                finally:
+                    resolver.close()
+
+            asyncio.run(resolve())
+
+            # TCP queries are prefixed by their length
+            with socket.create_connection(server.address) as connection:
+                query = DNSMessage.build_query(0x1234, "maps.example.com")
+                connection.sendall(struct.pack("!H", len(query)) + query)
+                length = struct.unpack("!H", connection.recv(2))[0]
+                response = DNSMessage.parse_response(connection.recv(length))
+                self.assertEqual(response[:3], (0x1234, DNSMessage.NOERROR, "maps.example.com"))
+                self.assertEqual(response[3], [("maps.example.com", DNSMessage.A, 300, "10.0.0.2")])
+
+            words = ["maps", "www", "oicunf", "dangling", "x.dev", "drive"]
+            bruteforcer = Model("example.com", None, words, resolver=UDPResolver([server.address], timeout=0.5))
+            bruteforcer.bruteforce_thread.join()
+            self.assertEqual(bruteforcer.found_subdomains,
+                             {"maps.example.com", "www.example.com", "dangling.example.com"})
+            self.assertEqual(bruteforcer.wildcards.discarded, 1)
+
+        # lost queries and bans are retried, until the ban ends
+        with StubDNSServer(zone, latency=0.01, jitter=0.01, loss=0.2, ban_rate=50, ban=0.2) as server:
+            words = ["maps", "oicunf"] * 50
+            bruteforcer = Model("example.com", None, words, resolver=UDPResolver([server.address], timeout=0.1),
+                                probe_interval=0.05, retry_delay=0.05, max_attempts=10)
+            bruteforcer.bruteforce_thread.join()
+            self.assertEqual(bruteforcer.found_subdomains, {"maps.example.com"})
+            self.assertEqual(bruteforcer.failed_count, 0)
+            self.assertGreater(server.dropped, 0)
+
+    def test_benchmarks(self):
+        results = benchmarks.run_benchmarks(word_count=1000, query_count=100, levels=[10], latency=0)
+        flat = benchmarks.flatten(results)
+        self.assertEqual(flat["end to end / system, concurrency 10 / found"], 10)
+        self.assertEqual(flat["end to end / async, concurrency 10 / found"], 10)
+        self.assertEqual(flat["resolver / udp, concurrency 10 / failures"], 0)
+        self.assertTrue(all(value > 0 for name, value in flat.items() if name.endswith("/second")))
+
 
 if __name__ == "__main__":
     unittest.main()